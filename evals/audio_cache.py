@@ -0,0 +1,100 @@
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+from datasets import Audio
+from datasets.fingerprint import Hasher
+from tqdm import tqdm
+
+# Bumped whenever the cache layout changes, so an old cache is rebuilt instead of misread
+CACHE_VERSION = 1
+
+
+class AudioCache:
+    """
+    Decoded and resampled audio of a dataset, stored as one contiguous float32 array and an offsets index.
+
+    The array is memory-mapped read-only: clips are zero-copy slices of it and the pages are shared by every process
+    reading the same cache, e.g. the workers of a sweep evaluating several models on one dataset.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        self.sampling_rate = self.index["sampling_rate"]
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"))
+
+        if self.offsets[-1] == 0:
+            # An empty file cannot be memory-mapped
+            self.samples = np.zeros(0, dtype=np.float32)
+        else:
+            self.samples = np.memmap(os.path.join(directory, "audio.f32"), dtype=np.float32, mode="r")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int):
+        return self.samples[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def durations(self):
+        """
+        Length of each clip in seconds.
+        """
+        return (np.diff(self.offsets) / self.sampling_rate).tolist()
+
+
+def build_audio_cache(dataset, directory: str, sampling_rate: int = 16_000, batch_size: int = 64):
+    """
+    Decodes and resamples every clip of a dataset once and writes them to an `AudioCache` directory.
+
+    The cache is written to a temporary directory and moved into place when complete, so an interrupted build leaves
+    no partial cache behind, and processes building the same cache at the same time keep the first finished one.
+    """
+    tmp_directory = f"{directory}.tmp-{os.getpid()}"
+    os.makedirs(tmp_directory, exist_ok=True)
+
+    dataset = dataset.select_columns(["audio"]).cast_column("audio", Audio(sampling_rate=sampling_rate))
+    offsets = [0]
+    with open(os.path.join(tmp_directory, "audio.f32"), "wb") as f:
+        batches = dataset.iter(batch_size=batch_size)
+        for batch in tqdm(batches, total=math.ceil(len(dataset) / batch_size), desc="Caching audio"):
+            for audio in batch["audio"]:
+                array = np.ascontiguousarray(audio["array"], dtype=np.float32)
+                f.write(array.tobytes())
+                offsets.append(offsets[-1] + len(array))
+
+    np.save(os.path.join(tmp_directory, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    index = {"version": CACHE_VERSION, "sampling_rate": sampling_rate, "num_samples": len(dataset),
+             "fingerprint": dataset._fingerprint}
+    with open(os.path.join(tmp_directory, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        # Another process finished the same cache first
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+def load_audio_cache(dataset, cache_dir: str, sampling_rate: int = 16_000):
+    """
+    Returns the `AudioCache` of a dataset, building it on first use.
+
+    Args:
+        dataset: `Dataset` with an `audio` column, before any other transform, as its fingerprint keys the cache.
+        cache_dir: Directory holding one cache per dataset.
+        sampling_rate: Optional, sampling rate the clips are resampled to.
+    """
+    key = Hasher.hash([dataset._fingerprint, sampling_rate, CACHE_VERSION])
+    directory = os.path.join(cache_dir, key)
+    if not os.path.exists(directory):
+        os.makedirs(cache_dir, exist_ok=True)
+        build_audio_cache(dataset, directory, sampling_rate=sampling_rate)
+
+    audio_cache = AudioCache(directory)
+    if len(audio_cache) != len(dataset):
+        raise ValueError(f"Audio cache {directory} holds {len(audio_cache)} clips, the dataset has {len(dataset)}.")
+    return audio_cache
@@ -2,20 +2,39 @@ import os
 import glob
 import json
 import evaluate
+import numpy as np
 import pandas as pd
 from collections import defaultdict
 import re
 import unicodedata
 import regex
-from datasets import load_from_disk, Audio
+from datasets import load_from_disk, concatenate_datasets, Audio, Features, IterableDataset, Value
+from datasets.fingerprint import Hasher
 import os
 import time
 from tqdm import tqdm
-from transformers import WhisperForConditionalGeneration, WhisperProcessor
 import torch
 from evaluate import load
 from types import SimpleNamespace
 import argparse
+import sys
+# Modules shared with the leaderboard (results store, spelling variants) are in the `normalizer` package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batching import bucket_batches, read_batch, run_batches, print_padding_report
+from timing import (PhaseTimer, PHASES, TRANSCRIPTION_PHASES, phase_columns, trial_columns, trial_throughput,
+                    format_phase_times)
+from prediction_cache import (PredictionCache, prediction_cache_columns, timed_totals, transcribe_with_cache,
+                              warn_cached)
+from sweep import run_sweep
+from filters import HallucinationFilter, filter_results, write_dropped, summarize_dropped
+from backends import (BACKENDS, QUANTIZATIONS, format_model_key, load_backend, transcribe_timed, warm_up,
+                      truncation_columns)
+from audio_cache import load_audio_cache
+from feature_cache import feature_cache_columns
+from latency import ArrivalSchedule, latency_columns, latency_model_key, latency_percentiles, format_latencies
+from normalizer.results_store import write_results
+from normalizer.variants import VariantLexicon, load_variant_lexicon
+from autotune import BATCH_SIZES, DEFAULT_BATCH_SIZE, autotune, load_tuned_config, apply_tuned_config
 
 
 def read_manifest(manifest_path: str):
@@ -38,10 +57,16 @@ def write_manifest(
         dataset_name: str,
         audio_length: list = None,
         transcription_time: list = None,
+        extra_fields: dict = None,
+        append: bool = False,
+        start_index: int = 0,
+        results_store: str = "./results_store/",
 ):
     """
     Writes a manifest file (jsonl format) and returns the path to the file.
 
+    The samples are also written to the partition of the model and dataset in the Parquet results store.
+
     Args:
         references: Ground truth reference texts.
         transcriptions: Model predicted transcriptions.
@@ -49,10 +74,15 @@ def write_manifest(
         dataset_name: Name of the dataset.
         audio_length: Length of each audio sample in seconds.
         transcription_time: Transcription time of each sample in seconds.
+        extra_fields: Optional, additional per-sample fields, mapping the field name to one value per sample.
+        append: Optional, append the samples to an existing manifest instead of overwriting it.
+        start_index: Optional, index of the first sample, used to number appended samples.
+        results_store: Optional, root directory of the results store, None to only write the manifest.
 
     Returns:
         Path to the manifest file.
     """
+    model_key = model_id
     model_id = model_id.replace("/", "-")
     dataset_name = dataset_name.replace("/", "-")
 
@@ -73,6 +103,14 @@ def write_manifest(
             f"must match `references` ({len(references)})."
         )
 
+    extra_fields = extra_fields if extra_fields is not None else {}
+    for key, values in extra_fields.items():
+        if len(values) != len(references):
+            raise ValueError(
+                f"The number of samples in `{key}` ({len(values)}) "
+                f"must match `references` ({len(references)})."
+            )
+
     audio_length = (
         audio_length if audio_length is not None else len(references) * [None]
     )
@@ -90,18 +128,32 @@ def write_manifest(
         basedir, f"MODEL_{model_id}_DATASET_{dataset_name}.jsonl"
     )
 
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        for idx, (text, transcript, audio_length, transcription_time) in enumerate(
-                zip(references, transcriptions, audio_length, transcription_time)
+    with open(manifest_path, "a" if append else "w", encoding="utf-8") as f:
+        for idx, (text, transcript, sample_length, sample_time) in enumerate(
+                zip(references, transcriptions, audio_length, transcription_time), start=start_index
         ):
             datum = {
                 "audio_filepath": f"sample_{idx}",  # dummy value for Speech Data Processor
-                "duration": audio_length,
-                "time": transcription_time,
+                "duration": sample_length,
+                "time": sample_time,
                 "text": text,
                 "pred_text": transcript,
             }
+            for key, values in extra_fields.items():
+                datum[key] = values[idx - start_index]
             f.write(f"{json.dumps(datum, ensure_ascii=False)}\n")
+
+    if results_store is not None:
+        write_results(
+            results_store,
+            model_key,
+            dataset_name,
+            {"duration": audio_length, "time": transcription_time, "text": references, "pred_text": transcriptions,
+             **extra_fields},
+            metadata={"manifest_path": manifest_path},
+            append=append,
+            start_index=start_index,
+        )
     return manifest_path
 
 
@@ -238,199 +290,512 @@ ADDITIONAL_DIACRITICS = {
 }
 
 
+def replace_symbol_or_diacritic(char: str, keep=""):
+    """
+    Replacement of one character by `remove_symbols_and_diacritics`.
+    """
+    if char in keep:
+        return char
+    elif char in ADDITIONAL_DIACRITICS:
+        return ADDITIONAL_DIACRITICS[char]
+
+    elif unicodedata.category(char) == "Mn":
+        return ""
+
+    elif unicodedata.category(char)[0] in "MSP":
+        return " "
+
+    return char
+
+
+def replace_symbol(char: str):
+    """
+    Replacement of one character by `remove_symbols`.
+    """
+    return " " if unicodedata.category(char)[0] in "MSP" else char
+
+
 def remove_symbols_and_diacritics(s: str, keep=""):
     """
     Replace any other markers, symbols, and punctuations with a space, and drop any diacritics (category 'Mn' and some
     manual mappings)
     """
+    return "".join(replace_symbol_or_diacritic(c, keep) for c in unicodedata.normalize("NFKD", s))
+
+
+def remove_symbols(s: str):
+    """
+    Replace any other markers, symbols, punctuations with a space, keeping diacritics
+    """
+    return "".join(replace_symbol(c) for c in unicodedata.normalize("NFKC", s))
 
-    def replace_character(char):
-        if char in keep:
-            return char
-        elif char in ADDITIONAL_DIACRITICS:
-            return ADDITIONAL_DIACRITICS[char]
 
-        elif unicodedata.category(char) == "Mn":
-            return ""
+class TranslationTable(dict):
+    """
+    `str.translate` table replacing every character by `replace(character)`.
 
-        elif unicodedata.category(char)[0] in "MSP":
-            return " "
+    The Latin-1 range and `precompute` are filled when the table is created, other code points are added the first
+    time they occur (`__missing__`), so a character is only looked up in the Unicode database once.
+    """
 
-        return char
+    def __init__(self, replace, precompute: str = ""):
+        super().__init__()
+        self.replace = replace
+        for code_point in list(range(256)) + [ord(char) for char in precompute]:
+            self[code_point] = replace(chr(code_point))
 
-    return "".join(replace_character(c) for c in unicodedata.normalize("NFKD", s))
+    def __missing__(self, code_point: int):
+        replacement = self.replace(chr(code_point))
+        self[code_point] = replacement
+        return replacement
 
 
-def remove_symbols(s: str):
+BRACKETS = re.compile(r"[<\[][^>\]]*[>\]]")
+PARENTHESES = re.compile(r"\(([^)]+?)\)")
+
+
+def collapse_whitespace(s: str):
     """
-    Replace any other markers, symbols, punctuations with a space, keeping diacritics
+    Same as `re.sub(r"\s+", " ", s)`: `str.split` splits on the characters `\s` matches, leading and trailing
+    whitespace is kept as one space.
     """
-    return "".join(" " if unicodedata.category(c)[0] in "MSP" else c for c in unicodedata.normalize("NFKC", s))
+    words = s.split()
+    collapsed = " ".join(words)
+    if s[:1].isspace():
+        collapsed = " " + collapsed if words else " "
+    if words and s[-1:].isspace():
+        collapsed += " "
+    return collapsed
 
 
 class BasicTextNormalizer:
-    def __init__(self, remove_diacritics: bool = False, split_letters: bool = False):
+    def __init__(self, remove_diacritics: bool = False, split_letters: bool = False, variants: dict = None):
         self.clean = remove_symbols_and_diacritics if remove_diacritics else remove_symbols
+        self.remove_diacritics = remove_diacritics
         self.split_letters = split_letters
+        self.variants = None
+
+        # `self.clean` compiled to a Unicode normalization and a single `str.translate` pass
+        if remove_diacritics:
+            self.unicode_form = "NFKD"
+            self.table = TranslationTable(replace_symbol_or_diacritic, precompute="".join(ADDITIONAL_DIACRITICS))
+        else:
+            self.unicode_form = "NFKC"
+            self.table = TranslationTable(replace_symbol)
+
+        # Optional spelling variant lexicon (variant -> canonical form), normalized like the texts it is applied to
+        if variants is not None:
+            self.variants = VariantLexicon(
+                {self(variant): self(canonical).strip() for variant, canonical in variants.items()}
+            )
 
     def __call__(self, s: str):
         s = s.lower()
-        s = re.sub(r"[<\[][^>\]]*[>\]]", "", s)  # remove words between brackets
-        s = re.sub(r"\(([^)]+?)\)", "", s)  # remove words between parenthesis
-        s = self.clean(s).lower()
+        if "<" in s or "[" in s:
+            s = BRACKETS.sub("", s)  # remove words between brackets
+        if "(" in s:
+            s = PARENTHESES.sub("", s)  # remove words between parenthesis
+        s = unicodedata.normalize(self.unicode_form, s).translate(self.table).lower()
 
         if self.split_letters:
             s = " ".join(regex.findall(r"\X", s, regex.U))
 
-        s = re.sub(r"\s+", " ", s)  # replace any successive whitespace characters with a space
+        s = collapse_whitespace(s)  # replace any successive whitespace characters with a space
+
+        if self.variants is not None:
+            s = self.variants(s)  # replace spelling variants by their canonical form
 
         return s
 
+    def config(self):
+        """
+        Settings that change the normalized text, part of the fingerprint of the normalized dataset column.
+        """
+        return {
+            "remove_diacritics": self.remove_diacritics,
+            "split_letters": self.split_letters,
+            "variants": self.variants.fingerprint if self.variants is not None else None,
+        }
+
+    def normalize_batch(self, texts: list):
+        """
+        Normalizes a list of texts, repeated texts (e.g. the references of a dataset scored for every model) are
+        normalized once.
+        """
+        normalized = {s: self(s) for s in dict.fromkeys(texts)}
+        return [normalized[s] for s in texts]
+
 
 normalizer = BasicTextNormalizer()
 
+# Benchmark result columns written to the manifest
+RESULT_COLUMNS = [
+    "audio_length_s",
+    "transcription_time_s",
+    "predictions",
+    "references",
+    *[f"time_{name}_s" for name in PHASES],
+    "mel_cache_hit",
+    "trial_times_s",
+    "latency_s",
+    "truncated",
+    "prediction_cached",
+]
 
-def normalize(batch):
-    batch["norm_text"] = normalizer(batch["transcript"])
-    return batch
 
+def normalize(transcripts):
+    return {"norm_text": normalizer.normalize_batch(transcripts)}
 
 
-def prepare_data(dataset):
-    # Step 1: Resample audio
-    #dataset = dataset['train'].cast_column("audio", Audio(sampling_rate=16_000))
-    dataset = dataset.cast_column("audio", Audio(sampling_rate=16_000))
+def normalize_transcripts(dataset, num_proc: int = None):
+    """
+    Adds the normalized transcripts in batches, using `num_proc` processes.
 
-    # Step 3: Normalize transcripts (optional)
-    dataset = dataset.map(normalize)
+    The normalized column only depends on the transcripts and the normalizer config, so its fingerprint is derived from
+    these: the first model of a sweep writes it to the dataset cache and the other models load it from there.
+    """
+    if isinstance(dataset, IterableDataset):
+        # Streamed samples are normalized on the fly, there is no cache to reuse. The features are passed on, so the
+        # audio column can still be cast afterwards.
+        features = None
+        if dataset.features is not None:
+            features = Features({**dataset.features, "norm_text": Value("string")})
+        return dataset.map(normalize, batched=True, input_columns=["transcript"], features=features)
 
-    return dataset
+    fingerprint = Hasher.hash([dataset._fingerprint, "norm_text", normalizer.config()])
+    return dataset.map(normalize, batched=True, input_columns=["transcript"], num_proc=num_proc,
+                       new_fingerprint=fingerprint, desc="Normalizing transcripts")
 
 
-def benchmark(batch, model, processor):
-    # Load audio inputs
-    audios = [audio["array"] for audio in batch["audio"]]
-    batch["audio_length_s"] = [len(audio["array"]) / 16000 for audio in batch["audio"]]
-    minibatch_size = len(audios)
+def add_duration(audios):
+    return {"audio_length_s": [len(audio["array"]) / 16000 for audio in audios]}
+
+
+
+def prepare_data(dataset, num_proc: int = None, audio_cache=None):
+    # Step 1: Normalize transcripts (optional), before the audio column is decoded
+    dataset = normalize_transcripts(dataset, num_proc=num_proc)
 
-    # START TIMING
-    start_time = time.time()
+    if audio_cache is not None:
+        # Steps 2 and 3: Audio is read from the memory-mapped cache, decoded and resampled once for every model
+        dataset = dataset.remove_columns(["audio"])
+        dataset = dataset.add_column("audio_index", list(range(len(dataset))))
+        dataset = dataset.add_column("audio_length_s", audio_cache.durations())
+        return dataset
 
-    # 1. Pre-Processing
-    # Padding
-    padding_size = None
-    if minibatch_size != 16:
-        padding_size = 16 - minibatch_size
-        padding_audios = [audios[-1] for _ in range(padding_size)]
-        audios.extend(padding_audios)
+    # Step 2: Resample audio
+    #dataset = dataset['train'].cast_column("audio", Audio(sampling_rate=16_000))
+    dataset = dataset.cast_column("audio", Audio(sampling_rate=16_000))
 
-    # Standard Whisper processing: pad audios to 30-seconds and converted to log-mel
-    inputs = processor(audios, sampling_rate=16_000, return_tensors="pt")
+    # Step 3: Audio durations, used to bucket samples of similar length. Only the new column is written to the dataset
+    # cache and joined to the other columns, `map` would write a copy of every column.
+    if isinstance(dataset, IterableDataset):
+        return dataset.map(add_duration, batched=True, input_columns=["audio"])
+    durations = dataset.map(add_duration, batched=True, input_columns=["audio"], remove_columns=dataset.column_names)
+    dataset = concatenate_datasets([dataset, durations], axis=1)
 
-    # 2. Model Inference
-    input_features = inputs.input_features
-    attention_mask = inputs.get("attention_mask")
+    return dataset
 
-    with torch.no_grad():
-        #predicted_ids = model.generate(input_features.to("cuda"), task="transcribe", language="nl",
-         #                              attention_mask=attention_mask)
-        predicted_ids = model.generate(input_features, task="transcribe", language="nl",
-                                       attention_mask=attention_mask)
 
-    # Remove the padding
-    if padding_size is not None:
-        predicted_ids = predicted_ids[:-padding_size, ...]
+def load_audios(batch, audio_cache=None):
+    # Zero-copy slices of the audio cache when there is one
+    if audio_cache is not None:
+        return [audio_cache[idx] for idx in batch["audio_index"]]
+    return [audio["array"] for audio in batch["audio"]]
 
-    # Convert token ids to text transcription
-    # DECODE OR BATCH DECODE?
-    pred_text = processor.batch_decode(predicted_ids, skip_special_tokens=True)
 
-    # END TIMING
-    runtime = time.time() - start_time
+def calibration_audios(dataset, num_samples: int, audio_cache=None):
+    """
+    Audio arrays of `num_samples` samples spread evenly over the dataset, used to autotune the model.
+    """
+    indices = sorted(set(np.linspace(0, len(dataset) - 1, min(num_samples, len(dataset))).astype(int).tolist()))
+    # Copies, memory-mapped slices of the audio cache are sent to the tuning process
+    return [np.array(audio) for audio in load_audios(read_batch(dataset, indices), audio_cache)]
+
+
+def apply_tuning(args, dataset, audio_cache=None):
+    """
+    Applies the threads and batch size tuned for the model on this machine, searching them first with `--autotune`.
+    The tuned batch size is used unless `--batch_size` is passed, `DEFAULT_BATCH_SIZE` without either.
+    """
+    tuned_config = None
+    if args.tuned_config:
+        # Packed and assisted runs are tuned on their own, packing and drafting change the work per batch
+        model_key = format_model_key(args.model_id, args.quantization, packed=args.pack,
+                                     assistant_id=args.assistant_model)
+        if args.autotune:
+            audios = calibration_audios(dataset, args.autotune_samples, audio_cache)
+            tuned_config = autotune(model_key, args.model_id, args.backend, args.quantization, audios,
+                                    args.tuned_config, packing_gap_s=args.pack_gap if args.pack else None,
+                                    assistant_id=args.assistant_model)
+        else:
+            tuned_config = load_tuned_config(args.tuned_config, model_key)
+    if tuned_config is not None:
+        batch_size = apply_tuned_config(tuned_config)
+        if args.batch_size is None:
+            args.batch_size = batch_size
+        elif args.batch_size != batch_size:
+            print(f"Batch size {args.batch_size} is used instead of the tuned batch size {batch_size}.")
+    if args.batch_size is None:
+        args.batch_size = DEFAULT_BATCH_SIZE
+
+
+def benchmark(batch, backend, prediction_cache=None, audio_cache=None, num_trials: int = 1, arrivals=None):
+    # Load audio inputs
+    audios = load_audios(batch, audio_cache)
+    minibatch_size = len(audios)
 
-    # normalize by minibatch size since we want the per-sample time
-    batch["transcription_time_s"] = minibatch_size * [runtime / minibatch_size]
+    if arrivals is not None:
+        # Latency run: the request is timed from its arrival until its transcription is normalized
+        arrival = arrivals.wait()
+        entries = transcribe_timed(backend, audios)
+    else:
+        # Samples transcribed by an earlier (possibly interrupted) run come from the prediction cache, without timings
+        entries = transcribe_with_cache(
+            prediction_cache, audios, lambda audios: transcribe_timed(backend, audios, num_trials=num_trials)
+        )
+    batch["transcription_time_s"] = [entry["transcription_time_s"] for entry in entries]
+    for name in TRANSCRIPTION_PHASES:
+        batch[f"time_{name}_s"] = [entry[f"time_{name}_s"] for entry in entries]
+    if prediction_cache is not None:
+        batch["prediction_cached"] = [entry["prediction_cached"] for entry in entries]
+    if backend.feature_cache is not None:
+        # Samples served by the prediction cache did not extract features in this run
+        batch["mel_cache_hit"] = [
+            None if entry.get("prediction_cached") else entry.get("mel_cache_hit") for entry in entries
+        ]
+    if num_trials > 1:
+        batch["trial_times_s"] = [entry.get("trial_times_s") for entry in entries]
+    if backend.max_tokens_per_second is not None:
+        batch["truncated"] = [entry.get("truncated") for entry in entries]
 
     # normalize transcriptions with English normalizer
-    batch["predictions"] = [normalizer(pred) for pred in pred_text]
+    timer = PhaseTimer()
+    with timer.phase("normalize"):
+        batch["predictions"] = normalizer.normalize_batch([entry["pred_text"] for entry in entries])
+    timer.per_sample(batch, minibatch_size)
+    if prediction_cache is not None:
+        # Cached samples are left out of the timings, including the decode and normalize time of this run
+        for column in [f"time_{name}_s" for name in PHASES if f"time_{name}_s" in batch]:
+            batch[column] = [
+                None if entry["prediction_cached"] else seconds for entry, seconds in zip(entries, batch[column])
+            ]
     batch["references"] = batch["norm_text"]
+    if arrivals is not None:
+        batch["latency_s"] = minibatch_size * [time.perf_counter() - arrival]
     return batch
 
 
 # Constants
 def main(args):
+    global normalizer
 
     wer_metric = load("wer")
 
-    dataset = load_from_disk(args.dataset)
-    dataset = prepare_data(dataset)
+    # Spelling variants are replaced by their canonical form in the references and the predictions
+    if args.variant_lexicon:
+        normalizer = BasicTextNormalizer(variants=load_variant_lexicon(args.variant_lexicon))
 
-    model = WhisperForConditionalGeneration.from_pretrained(args.model_id)
-    processor = WhisperProcessor.from_pretrained(args.model_id)
-
-    # Calling the benchmark function
-    results = dataset.map(
-        lambda batch: benchmark(batch, model=model, processor=processor),
-        batch_size=args.batch_size,
-        batched=True,
+    dataset = load_from_disk(args.dataset)
+    # Clips are decoded and resampled once into a memory-mapped cache shared by every model
+    audio_cache = None
+    if args.audio_cache:
+        audio_cache = load_audio_cache(dataset, args.audio_cache)
+    dataset = prepare_data(dataset, num_proc=args.num_proc, audio_cache=audio_cache)
+
+    # Threads and batch size tuned for this model on this machine, set before the model is loaded
+    apply_tuning(args, dataset, audio_cache)
+
+    # Whisper, wav2vec2, MMS, ... behind the same batched `transcribe` interface
+    # Quantized models are written under their own model key, e.g. `openai/whisper-large-v3+int8`
+    backend = load_backend(args.model_id, args.backend, quantization=args.quantization)
+
+    # Runaway generations are cut off at a token budget derived from the duration of each clip
+    if args.max_tokens_per_second:
+        backend.limit_generation(args.max_tokens_per_second)
+
+    # Short utterances share 30 second windows, written under their own model key, e.g. `openai/whisper-small+packed`
+    if args.pack:
+        backend.enable_packing(args.pack_gap)
+
+    # Tokens drafted by a smaller model and verified by the model, written under their own model key, e.g.
+    # `openai/whisper-large-v2+assisted-whisper-small`. Assisted generation transcribes one clip at a time.
+    if args.assistant_model:
+        backend.enable_assistant(args.assistant_model)
+        if backend.assistant_id is not None and args.batch_size > 1:
+            print(f"Assisted generation transcribes one clip at a time, batch size {args.batch_size} is set to 1.")
+            args.batch_size = 1
+
+    # Predictions of earlier (possibly interrupted) runs are reused, see `transcribe_with_cache`. Latency runs
+    # transcribe every request, a cached prediction has no latency. Runs with several trials time every batch again,
+    # a cached prediction has no trial times.
+    prediction_cache = None
+    if args.prediction_cache and args.mode == "throughput" and args.num_trials == 1:
+        prediction_cache = PredictionCache(args.prediction_cache, backend.model_key, backend.generation_config())
+
+    # Log-mel features of earlier runs, of this model or any model with the same feature extractor, are reused
+    if args.feature_cache:
+        backend.enable_feature_cache(args.feature_cache)
+
+    # Calling the benchmark function on batches of samples with similar duration, written back in dataset order
+    # Latency runs send the utterances one at a time, in dataset order, and are written under their own model key
+    durations = dataset["audio_length_s"]
+    model_key = backend.model_key
+    arrivals = None
+    if args.mode == "latency":
+        batches = [[idx] for idx in range(len(dataset))]
+        model_key = latency_model_key(backend.model_key, args.arrival_rate)
+        arrivals = ArrivalSchedule(args.arrival_rate)
+    else:
+        batches = bucket_batches(durations, args.batch_size, args.max_batch_seconds)
+    # The longest batches come last, warming up on them grows the allocator to its final size
+    if args.warmup_batches > 0:
+        warm_up(backend, [load_audios(read_batch(dataset, batch), audio_cache)
+                          for batch in batches[-args.warmup_batches:]])
+    results = run_batches(
+        dataset,
+        batches,
+        lambda batch: benchmark(batch, backend=backend, prediction_cache=prediction_cache,
+                                audio_cache=audio_cache, num_trials=args.num_trials, arrivals=arrivals),
         remove_columns=["audio"],
     )
-
-    # Post-processing - delete weird results
-    del_idx = []
-    for i in range(len(results)):
-        reference = results[i]['references'].split()
-        prediction = results[i]['predictions'].split()
-
-        if len(prediction) > 2 * len(reference):
-            del_idx.append(i)
-
-    results = results.select(
-        (
-            i for i in range(len(results))
-            if i not in set(del_idx)
-        )
+    if args.mode == "throughput":
+        print_padding_report(durations, batches, args.batch_size, padding=backend.padded_seconds)
+    if prediction_cache is not None:
+        print(f"Prediction cache: {prediction_cache.hits} hits, {prediction_cache.misses} transcribed")
+        prediction_cache.close()
+    if backend.feature_cache is not None:
+        print(f"Feature cache: {backend.feature_cache.hits} hits, {backend.feature_cache.misses} extracted")
+        backend.feature_cache.close()
+
+    # Post-processing - delete weird results, keeping track of what was dropped and why
+    hallucination_filter = HallucinationFilter(
+        max_length_ratio=args.max_length_ratio or None,
+        max_ngram_repeats=args.max_ngram_repeats,
+        ngram_size=args.ngram_size,
+        drop_empty=args.drop_empty,
     )
-
-    all_results = {
-        "audio_length_s": [],
-        "transcription_time_s": [],
-        "predictions": [],
-        "references": [],
-    }
-    result_iter = iter(results)
-    for result in tqdm(result_iter, desc="Samples..."):
-        for key in all_results:
-            all_results[key].append(result[key])
+    all_results, dropped = filter_results(results, hallucination_filter, RESULT_COLUMNS)
 
     # Write manifest results (WER and RTFX)
     manifest_path = write_manifest(
         all_results["references"],
         all_results["predictions"],
-        args.model_id,
+        model_key,
         os.path.basename(args.dataset),
         audio_length=all_results["audio_length_s"],
         transcription_time=all_results["transcription_time_s"],
+        extra_fields={**phase_columns(all_results), **trial_columns(all_results),
+                      **feature_cache_columns(all_results), **latency_columns(all_results),
+                      **truncation_columns(all_results), **prediction_cache_columns(all_results)},
     )
     print("Results saved at path:", os.path.abspath(manifest_path))
+    dropped_path = write_dropped(manifest_path, dropped)
+    print(f"Dropped samples ({summarize_dropped(dropped)}) saved at path:", os.path.abspath(dropped_path))
 
     wer = wer_metric.compute(
         references=all_results["references"], predictions=all_results["predictions"]
     )
     wer = round(100 * wer, 2)
-    rtfx = round(sum(all_results["audio_length_s"]) / sum(all_results["transcription_time_s"]), 2)
-    print("WER:", wer, "%", "RTFx:", rtfx)
+    # Samples served by the prediction cache have no timings, they are left out of the RTFx
+    audio_length, transcription_time = timed_totals(all_results["audio_length_s"], all_results["transcription_time_s"])
+    rtfx = round(audio_length / transcription_time, 2) if transcription_time > 0 else None
+    print("WER:", wer, "%", "RTFx:", rtfx if rtfx is not None else "n/a")
+    warn_cached(sum(all_results.get("prediction_cached", [])))
+    if "trial_times_s" in all_results:
+        throughput = trial_throughput(all_results["audio_length_s"], all_results["trial_times_s"])
+        if throughput is not None:
+            print(f"RTFx over {args.num_trials} trials: median {throughput[0]:.2f}, p95 {throughput[1]:.2f}")
+    if "latency_s" in all_results and len(all_results["latency_s"]) > 0:
+        print("Latency:", format_latencies(latency_percentiles(all_results["latency_s"])))
+    if "truncated" in results.column_names:
+        print(f"Truncated generations: {sum(bool(truncated) for truncated in results['truncated'])} of "
+              f"{len(results)} samples ({args.max_tokens_per_second:g} tokens per second)")
+    print("Time per phase:", format_phase_times(
+        {name: sum(seconds for seconds in all_results[f"time_{name}_s"] if seconds is not None) for name in PHASES}
+    ))
+    return manifest_path
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, default=r"C:\Users\b.caissottidichiusan\OneDrive - Stichting Onderwijs Koninklijke Auris Groep - 01JO\Desktop\auris\aurisTests\6yo_TOS_dataset")
+    parser.add_argument("--audio_dir", type=str,
+                        default=r"C:\Users\b.caissottidichiusan\OneDrive - Stichting Onderwijs Koninklijke Auris Groep - 01JO\Desktop\auris\auris_splits\TOS6")
+    parser.add_argument("--model_id", type=str, default="openai/whisper-small")
+    parser.add_argument("--backend", type=str, default=None, choices=sorted(BACKENDS),
+                        help="Backend of the model, detected from the model config by default.")
+    parser.add_argument("--quantization", type=str, default=None, choices=QUANTIZATIONS,
+                        help="Dynamic quantization of the linear layers for CPU inference.")
+    parser.add_argument("--batch_size", type=int, default=None,
+                        help="Samples per batch, by default the batch size tuned for the model on this machine "
+                             "(see `--tuned_config`) or 16.")
+    parser.add_argument("--num_proc", type=int, default=None,
+                        help="Number of processes normalizing the transcripts.")
+    parser.add_argument("--variant_lexicon", type=str, default=None,
+                        help="Spelling variant lexicon (`<variant>\\t<canonical>` lines) applied to the references and "
+                             "predictions, e.g. normalizer/dutch_spelling_variants.tsv.")
+    parser.add_argument("--audio_cache", type=str, default="./cache/audio/",
+                        help="Directory of the memory-mapped 16 kHz audio caches, an empty string disables it.")
+    parser.add_argument("--feature_cache", type=str, default=None,
+                        help="Directory of the log-mel feature cache shared by models with the same feature extractor "
+                             "(about 1 MB per clip for Whisper), disabled by default.")
+    parser.add_argument("--warmup_batches", type=int, default=1,
+                        help="Number of batches transcribed before the timed batches, left out of the timings.")
+    parser.add_argument("--num_trials", type=int, default=1,
+                        help="Number of timed trials per batch, the manifest reports the median time and the time of "
+                             "every trial. The prediction cache is not used with several trials.")
+    parser.add_argument("--mode", type=str, default="throughput", choices=["throughput", "latency"],
+                        help="Throughput runs transcribe batches of similar duration, latency runs send the utterances "
+                             "one at a time and record the latency of each request.")
+    parser.add_argument("--arrival_rate", type=float, default=None,
+                        help="Requests per second arriving as a Poisson process in latency mode, by default each "
+                             "request is sent when the previous one is done.")
+    parser.add_argument("--tuned_config", type=str, default="./cache/autotune.json",
+                        help="Threads and batch size tuned per model and CPU, applied to the run when the model was "
+                             "tuned on this machine. An empty string disables it.")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Search the threads and batch size with the highest RTFx first and save them.")
+    parser.add_argument("--autotune_samples", type=int, default=max(BATCH_SIZES),
+                        help="Number of calibration samples the autotuner runs on, batch sizes above it are not "
+                             "searched.")
+    parser.add_argument("--max_batch_seconds", type=float, default=None,
+                        help="Maximum padded audio per batch (batch size x longest clip) in seconds.")
+    parser.add_argument("--prediction_cache", type=str, default="",
+                        help="Path of the prediction cache reusing the predictions of earlier runs, disabled by "
+                             "default. Cached samples are flagged in the manifest and left out of the RTFx.")
+    parser.add_argument("--max_tokens_per_second", type=float, default=None,
+                        help="Cut off the generation of each clip after this many tokens per second of audio (plus a "
+                             "small margin), truncated samples are flagged in the manifest. Disabled by default.")
+    parser.add_argument("--pack", action="store_true",
+                        help="Join the utterances of a batch, separated by silence, into shared 30 second windows and "
+                             "split the transcription back by timestamps.")
+    parser.add_argument("--pack_gap", type=float, default=0.5,
+                        help="Silence between the packed utterances of a window in seconds.")
+    parser.add_argument("--assistant_model", type=str, default=None,
+                        help="Smaller model with the same features and tokenizer drafting the tokens the model "
+                             "verifies (assisted generation), e.g. openai/whisper-small for openai/whisper-large-v2.")
+    parser.add_argument("--max_length_ratio", type=float, default=2.0,
+                        help="Drop predictions with more than this many times the words of the reference, 0 disables.")
+    parser.add_argument("--max_ngram_repeats", type=int, default=None,
+                        help="Drop predictions repeating one n-gram more often than this.")
+    parser.add_argument("--ngram_size", type=int, default=3)
+    parser.add_argument("--drop_empty", action="store_true", help="Drop empty predictions.")
+    return parser
 
 
 if __name__ == "__main__":
     whispers = ["openai/whisper-small","openai/whisper-medium","openai/whisper-large-v2","openai/whisper-large-v3"]
-    
-    for w in whispers:
-        parser = argparse.ArgumentParser()
-        parser.add_argument("--dataset", type=str, default=r"C:\Users\b.caissottidichiusan\OneDrive - Stichting Onderwijs Koninklijke Auris Groep - 01JO\Desktop\auris\aurisTests\6yo_TOS_dataset")
-        parser.add_argument("--audio_dir", type=str,
-                            default=r"C:\Users\b.caissottidichiusan\OneDrive - Stichting Onderwijs Koninklijke Auris Groep - 01JO\Desktop\auris\auris_splits\TOS6")
-        parser.add_argument("--model_id", type=str, default=w)
-        parser.add_argument("--batch_size", type=str, default=16)
-        args = parser.parse_args()
-        main(args)
\ No newline at end of file
+
+    parser = get_parser()
+    parser.add_argument("--model_ids", type=str, nargs="+", default=whispers)
+    parser.add_argument("--num_workers", type=int, default=1,
+                        help="Number of models evaluated in parallel, see `run_sweep`.")
+    args = parser.parse_args()
+
+    if args.audio_cache:
+        # Built before the sweep starts, so its workers share one cache instead of each decoding the clips
+        load_audio_cache(load_from_disk(args.dataset), args.audio_cache)
+
+    jobs = [argparse.Namespace(**{**vars(args), "model_id": model_id}) for model_id in args.model_ids]
+    run_sweep("auris_eval", jobs, num_workers=args.num_workers)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from backends import load_backend, warm_up
+from batching import bucket_batches
+
+# Batch sizes searched by `autotune`
+BATCH_SIZES = [1, 4, 8, 16, 32]
+
+# Batch size of runs without an explicit `--batch_size` or a tuned batch size
+DEFAULT_BATCH_SIZE = 16
+
+# Torch threads of this process, recorded once when it imports this module: all cores, or the share of a sweep worker
+# (see `sweep._init_worker`). Tuned threads are capped by it, not by the threads set by the previous job of a sweep.
+THREAD_BUDGET = torch.get_num_threads()
+
+
+def cpu_signature():
+    """
+    Identifies the machine a configuration is tuned on: CPU model, number of cores and torch version.
+    """
+    processor = platform.processor()
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    processor = line.split(":", 1)[1].strip()
+                    break
+    return {
+        "machine": platform.machine(),
+        "processor": processor,
+        "num_cores": os.cpu_count(),
+        "torch": torch.__version__,
+    }
+
+
+def tuning_key(model_key: str, signature: dict):
+    cpu_hash = hashlib.sha256(json.dumps(signature, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{model_key} | {cpu_hash}"
+
+
+def thread_counts(num_cores: int):
+    """
+    Powers of two up to the number of cores, and the number of cores itself.
+    """
+    counts = {num_cores}
+    count = 1
+    while count < num_cores:
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+
+def load_tuned_configs(path: str):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_tuned_config(path: str, key: str, config: dict):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    configs = load_tuned_configs(path)
+    configs[key] = config
+    # Written to a temporary file first, so a concurrent run never reads a partially written file
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(configs, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(num_interop_threads: int):
+    # Inter-op threads can only be set before the first inter-op parallel work of a process
+    torch.set_num_interop_threads(num_interop_threads)
+
+
+def _measure(model_id: str, backend: str, quantization: str, packing_gap_s: float, assistant_id: str, audios: list,
+             num_threads: list, batch_sizes: list):
+    """
+    Measures the RTFx of each number of threads and batch size on the calibration audios, in a worker process.
+    """
+    asr_backend = load_backend(model_id, backend, quantization=quantization)
+    if packing_gap_s is not None:
+        asr_backend.enable_packing(packing_gap_s)
+    if assistant_id is not None:
+        asr_backend.enable_assistant(assistant_id)
+    durations = [len(audio) / 16_000 for audio in audios]
+
+    measurements = []
+    for threads in num_threads:
+        torch.set_num_threads(threads)
+        for batch_size in batch_sizes:
+            batches = bucket_batches(durations, batch_size)
+            warm_up(asr_backend, [[audios[idx] for idx in batches[-1]]])
+
+            start_time = time.perf_counter()
+            for batch in batches:
+                asr_backend.transcribe([audios[idx] for idx in batch])
+            elapsed = time.perf_counter() - start_time
+            measurements.append({"num_threads": threads, "batch_size": batch_size, "rtfx": sum(durations) / elapsed})
+    return measurements
+
+
+def autotune(model_key: str, model_id: str, backend: str, quantization: str, audios: list, path: str,
+             batch_sizes: list = None, packing_gap_s: float = None, assistant_id: str = None):
+    """
+    Searches the intra-op threads, inter-op threads and batch size with the highest RTFx on a calibration slice, and
+    saves the best configuration for the model on this machine.
+
+    Every number of inter-op threads is measured in a fresh process, as torch fixes them for the lifetime of a
+    process.
+
+    Args:
+        model_key: Model id of the manifests, e.g. `openai/whisper-large-v3+int8`.
+        model_id: Model on the Hugging Face Hub or local path.
+        backend: Optional, name of the backend, see `load_backend`.
+        quantization: Optional, quantization of the model, see `load_backend`.
+        audios: Calibration audio arrays (16 kHz).
+        path: JSON file holding the tuned configurations, keyed by model and CPU signature.
+        batch_sizes: Optional, batch sizes to search, `BATCH_SIZES` by default.
+        packing_gap_s: Optional, measure packed windows with this gap between the utterances, see `enable_packing`.
+        assistant_id: Optional, measure assisted generation with this assistant model, see `enable_assistant`. Assisted
+            generation transcribes one clip at a time, only batch size 1 is searched.
+
+    Returns:
+        The best configuration.
+    """
+    signature = cpu_signature()
+    num_cores = signature["num_cores"] or 1
+    batch_sizes = [1] if assistant_id is not None else batch_sizes or BATCH_SIZES
+    skipped = [size for size in batch_sizes if size > len(audios)]
+    batch_sizes = [size for size in batch_sizes if size <= len(audios)] or [len(audios)]
+    print(f"Autotuning {model_key} on {len(audios)} calibration samples ({signature['processor']}, {num_cores} cores)")
+    if len(skipped) > 0:
+        print(f"Batch sizes {skipped} are not searched, they exceed the {len(audios)} calibration samples.")
+
+    measurements = []
+    for num_interop_threads in sorted({1, min(2, num_cores)}):
+        with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(num_interop_threads,),
+        ) as executor:
+            future = executor.submit(_measure, model_id, backend, quantization, packing_gap_s, assistant_id, audios,
+                                     thread_counts(num_cores), batch_sizes)
+            for measurement in future.result():
+                measurements.append({**measurement, "num_interop_threads": num_interop_threads})
+
+    for measurement in measurements:
+        print(f"threads {measurement['num_threads']}, inter-op threads {measurement['num_interop_threads']}, "
+              f"batch size {measurement['batch_size']}: RTFx {measurement['rtfx']:.2f}")
+
+    best = max(measurements, key=lambda measurement: measurement["rtfx"])
+    config = {**best, "cpu": signature, "calibration_samples": len(audios), "tuned_at": time.time(),
+              "measurements": measurements}
+    save_tuned_config(path, tuning_key(model_key, signature), config)
+    return config
+
+
+def load_tuned_config(path: str, model_key: str):
+    """
+    Returns the configuration tuned for the model on this machine, or None if it was not tuned yet.
+    """
+    return load_tuned_configs(path).get(tuning_key(model_key, cpu_signature()))
+
+
+def apply_tuned_config(config: dict):
+    """
+    Sets the tuned torch threads of the current process and returns the tuned batch size.
+
+    The threads are capped by `THREAD_BUDGET`, so the workers of a sweep keep their share of the cores.
+    """
+    torch.set_num_threads(min(config["num_threads"], THREAD_BUDGET))
+    try:
+        torch.set_num_interop_threads(config["num_interop_threads"])
+    except RuntimeError:
+        # Inter-op work already ran in this process, it keeps its inter-op threads
+        pass
+    print(f"Tuned config: {torch.get_num_threads()} threads, {torch.get_num_interop_threads()} inter-op threads, "
+          f"batch size {config['batch_size']} (RTFx {config['rtfx']:.2f} on calibration)")
+    return config["batch_size"]
@@ -0,0 +1,560 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+import torch
+from transformers import (
+    AutoConfig,
+    AutoModelForCTC,
+    AutoProcessor,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    WhisperForConditionalGeneration,
+    WhisperProcessor,
+)
+
+from batching import padded_seconds
+from feature_cache import FeatureCache
+from packing import WINDOW_SECONDS, assign_segments, crosses_gap, join_window, pack_windows, time_shares, unpack
+from timing import TRANSCRIPTION_PHASES, PhaseTimer
+
+# Registered backends, by name
+BACKENDS = {}
+
+# Supported values of `ASRBackend.quantize`
+QUANTIZATIONS = ["int8"]
+
+
+def format_model_key(model_id: str, quantization: str = None, packed: bool = False, assistant_id: str = None):
+    """
+    Model id of the manifests, e.g. `openai/whisper-large-v3+int8` for a quantized model,
+    `openai/whisper-small+packed` for a model transcribing packed windows or
+    `openai/whisper-large-v2+assisted-whisper-small` for a model verifying the tokens drafted by an assistant.
+    """
+    model_key = model_id
+    if quantization is not None:
+        model_key = f"{model_key}+{quantization}"
+    if assistant_id is not None:
+        model_key = f"{model_key}+assisted-{assistant_id.rstrip('/').split('/')[-1]}"
+    if packed:
+        model_key = f"{model_key}+packed"
+    return model_key
+
+
+def register_backend(name: str):
+    def decorator(cls):
+        BACKENDS[name] = cls
+        cls.name = name
+        return cls
+
+    return decorator
+
+
+class ASRBackend(ABC):
+    """
+    Batched speech recognition model: `transcribe(arrays)` returns one raw transcription per 16 kHz audio array.
+
+    Backends time their phases with the `PhaseTimer` passed to `transcribe`, using the phase names of `PHASES`
+    ("mel" being the feature extraction of the backend), so every architecture reports the same breakdown.
+    """
+
+    name = None
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.quantization = None
+        self.feature_cache = None
+        # Tokens generated per second of audio at most, see `limit_generation`
+        self.max_tokens_per_second = None
+        # Whether the generation of each audio of the last batch was cut off by its token budget
+        self.last_truncated = None
+        # Silence between the utterances of a packed window in seconds, see `enable_packing`
+        self.packing_gap_s = None
+        # Share of the transcription time of the last batch spent on each audio, None when spread evenly
+        self.last_time_shares = None
+        # Model drafting the tokens the model verifies, see `enable_assistant`
+        self.assistant_id = None
+
+    @property
+    def model_key(self):
+        """
+        Model id of the manifests, e.g. `openai/whisper-large-v3+int8` for a quantized model.
+        """
+        return format_model_key(self.model_id, self.quantization, packed=self.packing_gap_s is not None,
+                                assistant_id=self.assistant_id)
+
+    def generation_config(self):
+        """
+        Settings that change the output of the model, part of the prediction cache key.
+        """
+        return {"backend": self.name, "quantization": self.quantization}
+
+    def quantize(self, quantization: str):
+        """
+        Applies dynamic quantization to the linear layers of the model, for CPU inference.
+        """
+        if quantization != "int8":
+            raise ValueError(f"Unknown quantization `{quantization}`, expected one of {QUANTIZATIONS}.")
+        self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.quantization = quantization
+
+    def padded_seconds(self, durations: list, batches: list, pad_batches_to: int = None):
+        """
+        Padding in seconds the backend adds to the batches, see `batching.padded_seconds`: every clip of a batch is
+        padded to the longest clip of that batch.
+        """
+        return padded_seconds(durations, batches, pad_batches_to=pad_batches_to)
+
+    def enable_feature_cache(self, cache_dir: str):
+        """
+        Reuses the input features of audios seen before, see `FeatureCache`. Backends whose features are not worth
+        caching (e.g. CTC models, which take the waveform) leave this disabled.
+        """
+        print(f"The {self.name} backend does not cache its input features.")
+
+    def limit_generation(self, max_tokens_per_second: float):
+        """
+        Cuts off the generation of each clip at a token budget derived from its duration, see `TokenBudget`.
+        Backends without a generation loop (e.g. CTC models, whose output is bounded by their frames) ignore this.
+        """
+        print(f"The {self.name} backend has no generation loop, its output length is not limited.")
+
+    def enable_packing(self, gap_seconds: float):
+        """
+        Joins the short utterances of a batch into shared input windows, see `pack_windows`. Backends without a fixed
+        input window (e.g. CTC models, which pad each batch to its longest clip) leave this disabled.
+        """
+        print(f"The {self.name} backend has no fixed input window, its utterances are not packed.")
+
+    def enable_assistant(self, assistant_id: str):
+        """
+        Lets a smaller assistant model draft the tokens, which the model verifies in one forward pass (assisted
+        generation). Backends without a generation loop (e.g. CTC models) have nothing to draft.
+        """
+        print(f"The {self.name} backend has no generation loop, it cannot use an assistant model.")
+
+    @abstractmethod
+    def transcribe(self, arrays: list, timer: PhaseTimer = None):
+        """
+        Returns one raw transcription per 16 kHz audio array, timing the phases with `timer`.
+        """
+
+
+class TokenBudget(StoppingCriteria):
+    """
+    Stops the generation of each sequence of a batch once it holds more text tokens than its clip can plausibly be
+    transcribed with: `max_tokens_per_second` tokens per second of audio, plus `margin` tokens for short clips.
+
+    Degenerate repeat loops are cut off while they are generated, instead of running up to the maximum target length
+    and being dropped afterwards. Sequences cut off before their end-of-text token are flagged in `truncated`.
+
+    Only text tokens count: Whisper's special tokens (the decoder prompt of start-of-transcript, language and task
+    tokens) and its timestamp tokens all come after its end-of-text token. The count does not depend on how many
+    tokens a generation step adds, e.g. the draft tokens accepted at once in assisted generation.
+    """
+
+    def __init__(self, durations: list, max_tokens_per_second: float, eos_token_id: int, margin: int = 8):
+        self.budgets = torch.tensor([int(np.ceil(duration * max_tokens_per_second)) + margin for duration in durations])
+        self.eos_token_id = eos_token_id
+        self.ended = torch.zeros(len(durations), dtype=torch.bool)
+        self.truncated = torch.zeros(len(durations), dtype=torch.bool)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.ended |= (input_ids == self.eos_token_id).any(dim=1).cpu()
+
+        num_text_tokens = (input_ids < self.eos_token_id).sum(dim=1).cpu()
+        over_budget = self.budgets <= num_text_tokens
+        self.truncated |= over_budget & ~self.ended
+        return over_budget.to(input_ids.device)
+
+
+@register_backend("whisper")
+class WhisperBackend(ASRBackend):
+    """
+    Whisper sequence-to-sequence models, every clip padded to a 30 second log-mel window.
+
+    With packing, the short utterances of a batch share windows instead: they are joined with silence in between,
+    transcribed with timestamps, and the segments are split back to the utterances by their timestamps.
+
+    With an assistant model, the assistant drafts the tokens and the model verifies them. Assisted generation
+    transcribes one clip at a time.
+    """
+
+    def __init__(self, model_id: str, generate_kwargs: dict = None):
+        super().__init__(model_id)
+        self.model = WhisperForConditionalGeneration.from_pretrained(model_id)
+        self.processor = WhisperProcessor.from_pretrained(model_id)
+        if generate_kwargs is None:
+            generate_kwargs = {"task": "transcribe", "language": "nl"}
+        self.generate_kwargs = generate_kwargs
+        self.assistant = None
+
+    def generation_config(self):
+        config = {**super().generation_config(), **self.model.generation_config.to_dict(), **self.generate_kwargs}
+        # Only set when limited, so the cached predictions of unlimited runs keep their key
+        if self.max_tokens_per_second is not None:
+            config["max_tokens_per_second"] = self.max_tokens_per_second
+        if self.packing_gap_s is not None:
+            config["packing_gap_s"] = self.packing_gap_s
+        if self.assistant_id is not None:
+            config["assistant_id"] = self.assistant_id
+        return config
+
+    def limit_generation(self, max_tokens_per_second: float):
+        self.max_tokens_per_second = max_tokens_per_second
+
+    def enable_packing(self, gap_seconds: float):
+        self.packing_gap_s = gap_seconds
+
+    def padded_seconds(self, durations: list, batches: list, pad_batches_to: int = None):
+        # Every clip, or every packed window, is padded to a full window whatever the other clips of its batch
+        padding = 0.0
+        for batch in batches:
+            lengths = [durations[idx] for idx in batch]
+            # Short batches are filled up with copies of their longest clip, counted as padding entirely
+            slots = lengths + (max(pad_batches_to or 0, len(batch)) - len(batch)) * [max(lengths)]
+            num_windows = len(pack_windows(slots, self.packing_gap_s)) if self.packing_gap_s is not None else len(slots)
+            padding += num_windows * WINDOW_SECONDS - sum(min(length, WINDOW_SECONDS) for length in lengths)
+        return padding
+
+    def enable_assistant(self, assistant_id: str):
+        assistant = WhisperForConditionalGeneration.from_pretrained(assistant_id)
+        assistant_processor = WhisperProcessor.from_pretrained(assistant_id)
+
+        # The assistant reads the same log-mel features and its drafted token ids are verified as they are
+        mismatches = [
+            name for name in ["num_mel_bins", "vocab_size"]
+            if getattr(self.model.config, name) != getattr(assistant.config, name)
+        ]
+        if self.processor.tokenizer.get_vocab() != assistant_processor.tokenizer.get_vocab():
+            mismatches.append("tokenizer")
+        if len(mismatches) > 0:
+            raise ValueError(
+                f"`{assistant_id}` cannot assist `{self.model_id}`, their {', '.join(mismatches)} differ. "
+                f"The assistant needs the features and tokenizer of the model, e.g. `openai/whisper-small` for "
+                f"`openai/whisper-large-v2` or `distil-whisper/distil-large-v3` for `openai/whisper-large-v3`."
+            )
+
+        assistant.eval()
+        if self.quantization is not None:
+            assistant = torch.ao.quantization.quantize_dynamic(assistant, {torch.nn.Linear}, dtype=torch.qint8)
+        self.assistant = assistant
+        self.assistant_id = assistant_id
+
+    def enable_feature_cache(self, cache_dir: str):
+        if self.processor.feature_extractor.return_attention_mask:
+            # Only the features are cached, not the attention mask
+            print(f"The feature extractor of {self.model_id} returns an attention mask, its features are not cached.")
+            return
+        self.feature_cache = FeatureCache(cache_dir, self.processor.feature_extractor)
+
+    def extract_features(self, arrays: list):
+        return self.processor(arrays, sampling_rate=16_000, return_tensors="np").input_features
+
+    def generate(self, arrays: list, timer: PhaseTimer, **generate_kwargs):
+        """
+        Runs the feature extraction, encoder and generation of a batch of audio arrays and returns the token ids.
+        """
+        # Standard Whisper processing: pad audios to 30-seconds and converted to log-mel
+        with timer.phase("mel"):
+            if self.feature_cache is not None:
+                input_features = torch.from_numpy(self.feature_cache.features(arrays, self.extract_features))
+                attention_mask = None
+            else:
+                inputs = self.processor(arrays, sampling_rate=16_000, return_tensors="pt")
+                input_features = inputs.input_features
+                attention_mask = inputs.get("attention_mask")
+
+        with torch.no_grad():
+            if self.assistant is not None:
+                # Assisted generation runs the encoders of the model and the assistant itself, in the generate phase
+                inputs = {"input_features": input_features}
+                generate_kwargs = {**generate_kwargs, "assistant_model": self.assistant}
+            else:
+                with timer.phase("encoder"):
+                    inputs = {"encoder_outputs": self.model.get_encoder()(input_features)}
+            with timer.phase("generate"):
+                generate_kwargs = {**self.generate_kwargs, **generate_kwargs}
+                budget = None
+                if self.max_tokens_per_second is not None:
+                    budget = TokenBudget([len(audio) / 16_000 for audio in arrays], self.max_tokens_per_second,
+                                         self.model.generation_config.eos_token_id)
+                    generate_kwargs = {**generate_kwargs, "stopping_criteria": StoppingCriteriaList([budget])}
+                predicted_ids = self.model.generate(**inputs, attention_mask=attention_mask, **generate_kwargs)
+                self.last_truncated = budget.truncated.tolist() if budget is not None else None
+        return predicted_ids
+
+    def timestamp_segments(self, token_ids):
+        """
+        Returns the `(start, end, text)` segments of a transcription generated with timestamps, times in seconds. The
+        end of a segment is None when no timestamp follows it.
+        """
+        timestamp_begin = self.model.generation_config.no_timestamps_token_id + 1
+        segments = []
+        start = 0.0
+        tokens = []
+        for token in token_ids.tolist():
+            if token >= timestamp_begin:
+                time = (token - timestamp_begin) * 0.02
+                if len(tokens) > 0:
+                    segments.append((start, time, tokens))
+                    tokens = []
+                start = time
+            else:
+                tokens.append(token)
+        if len(tokens) > 0:
+            segments.append((start, None, tokens))
+        # Special tokens (task, language, end of text) decode to nothing
+        segments = [
+            (start, end, self.processor.tokenizer.decode(tokens, skip_special_tokens=True))
+            for start, end, tokens in segments
+        ]
+        return [(start, end, text) for start, end, text in segments if text.strip()]
+
+    def word_segments(self, token_ids, token_times):
+        """
+        Returns the `(start, end, text)` of each word of a transcription, from the token-level timestamps aligned by
+        the cross-attention of the model. A token lasts until the next one, a word starts at a token with a leading
+        space or after a timestamp.
+        """
+        # Whisper's special and timestamp tokens come after its text tokens
+        first_special = self.model.generation_config.eos_token_id
+        token_ids = token_ids.tolist()
+        token_times = token_times.tolist()
+        words = []
+        after_special = True
+        for position, token in enumerate(token_ids):
+            if token >= first_special:
+                after_special = True
+                continue
+            end = token_times[position + 1] if position + 1 < len(token_times) else None
+            if after_special or self.processor.tokenizer.decode([token]).startswith(" "):
+                words.append([token_times[position], end, [token]])
+            else:
+                words[-1][1] = end
+                words[-1][2].append(token)
+            after_special = False
+        words = [(start, end, self.processor.tokenizer.decode(tokens)) for start, end, tokens in words]
+        return [(start, end, text) for start, end, text in words if text.strip()]
+
+    def transcribe_unpacked(self, arrays: list, timer: PhaseTimer):
+        predicted_ids = self.generate(arrays, timer)
+        with timer.phase("detokenize"):
+            return self.processor.batch_decode(predicted_ids, skip_special_tokens=True)
+
+    def transcribe_packed(self, arrays: list, timer: PhaseTimer):
+        windows = pack_windows([len(audio) / 16_000 for audio in arrays], self.packing_gap_s)
+        with timer.phase("mel"):
+            window_arrays = [join_window(arrays, window, self.packing_gap_s) for window in windows]
+
+        # Whisper does not always end a segment at a gap, word-level timestamps split such segments between the
+        # utterances. They are aligned by the cross-attention heads listed in the generation config of the checkpoint.
+        word_timestamps = (any(len(window.indices) > 1 for window in windows)
+                           and getattr(self.model.generation_config, "alignment_heads", None) is not None)
+        outputs = self.generate(window_arrays, timer, return_timestamps=True, return_token_timestamps=word_timestamps)
+
+        with timer.phase("detokenize"):
+            if word_timestamps:
+                segments = [
+                    self.word_segments(token_ids, token_times)
+                    for token_ids, token_times in zip(outputs["sequences"], outputs["token_timestamps"])
+                ]
+            else:
+                segments = [self.timestamp_segments(token_ids) for token_ids in outputs]
+            pred_text = len(arrays) * [None]
+            unpacked = []
+            for window, window_segments in zip(windows, segments):
+                if not word_timestamps and crosses_gap(window, window_segments):
+                    unpacked.extend(window.indices)
+                    continue
+                for idx, text in zip(window.indices, assign_segments(window, window_segments)):
+                    pred_text[idx] = text
+
+        # Flags of each window apply to all of its utterances
+        truncated = unpack(self.last_truncated, windows, len(arrays)) if self.last_truncated is not None else None
+        if self.feature_cache is not None:
+            self.feature_cache.last_hits = unpack(self.feature_cache.last_hits, windows, len(arrays))
+        shares = time_shares(windows)
+
+        if len(unpacked) > 0:
+            # Without word timestamps, the utterances of windows with a segment across a gap are transcribed again,
+            # unpacked. That batch takes its share of the time, spread evenly over its utterances.
+            unpacked_timer = PhaseTimer()
+            for idx, text in zip(unpacked, self.transcribe_unpacked([arrays[idx] for idx in unpacked], unpacked_timer)):
+                pred_text[idx] = text
+            if truncated is not None:
+                for idx, is_truncated in zip(unpacked, self.last_truncated):
+                    truncated[idx] = is_truncated
+
+            packed_time = timer.transcription_time()
+            unpacked_time = unpacked_timer.transcription_time()
+            if packed_time + unpacked_time > 0:
+                shares = [share * packed_time / (packed_time + unpacked_time) for share in shares]
+                for idx in unpacked:
+                    shares[idx] += unpacked_time / (packed_time + unpacked_time) / len(unpacked)
+            for name, seconds in unpacked_timer.totals.items():
+                timer.totals[name] += seconds
+
+        self.last_truncated = truncated
+        self.last_time_shares = shares
+        return pred_text
+
+    def transcribe(self, arrays: list, timer: PhaseTimer = None):
+        timer = timer if timer is not None else PhaseTimer()
+        if self.packing_gap_s is not None:
+            return self.transcribe_packed(arrays, timer)
+        return self.transcribe_unpacked(arrays, timer)
+
+
+@register_backend("ctc")
+class CTCBackend(ASRBackend):
+    """
+    CTC models (wav2vec2, MMS) with greedy decoding, each batch padded to its longest clip.
+    """
+
+    def __init__(self, model_id: str, target_lang: str = "nld"):
+        super().__init__(model_id)
+        config = AutoConfig.from_pretrained(model_id)
+        self.target_lang = None
+        if getattr(config, "adapter_attn_dim", None) is not None:
+            # MMS checkpoints hold one adapter and vocabulary per language
+            self.target_lang = target_lang
+            self.processor = AutoProcessor.from_pretrained(model_id)
+            self.processor.tokenizer.set_target_lang(target_lang)
+            self.model = AutoModelForCTC.from_pretrained(model_id, target_lang=target_lang,
+                                                         ignore_mismatched_sizes=True)
+        else:
+            self.processor = AutoProcessor.from_pretrained(model_id)
+            self.model = AutoModelForCTC.from_pretrained(model_id)
+        self.model.eval()
+
+        # Checkpoints with group norm in the feature encoder are trained without attention mask on zero padding
+        self.use_attention_mask = self.processor.feature_extractor.return_attention_mask
+
+    def generation_config(self):
+        return {**super().generation_config(), "decoding": "greedy", "target_lang": self.target_lang}
+
+    def transcribe(self, arrays: list, timer: PhaseTimer = None):
+        timer = timer if timer is not None else PhaseTimer()
+
+        with timer.phase("mel"):
+            inputs = self.processor(arrays, sampling_rate=16_000, padding="longest", return_tensors="pt",
+                                    return_attention_mask=True)
+
+        attention_mask = inputs.attention_mask
+        with torch.no_grad():
+            with timer.phase("encoder"):
+                logits = self.model(
+                    inputs.input_values,
+                    attention_mask=attention_mask if self.use_attention_mask else None,
+                ).logits
+
+            with timer.phase("generate"):
+                predicted_ids = torch.argmax(logits, dim=-1)
+                # Frames produced by the padding are set to the pad (blank) token, which CTC decoding drops
+                output_lengths = self.model._get_feat_extract_output_lengths(attention_mask.sum(-1))
+                padding = torch.arange(predicted_ids.shape[1])[None, :] >= output_lengths[:, None]
+                predicted_ids = predicted_ids.masked_fill(padding, self.processor.tokenizer.pad_token_id)
+
+        with timer.phase("detokenize"):
+            return self.processor.batch_decode(predicted_ids)
+
+
+def load_backend(model_id: str, backend: str = None, quantization: str = None, **kwargs):
+    """
+    Loads a model into the backend for its architecture.
+
+    Args:
+        model_id: Model on the Hugging Face Hub or local path.
+        backend: Optional, name of a registered backend. Detected from the model config by default.
+        quantization: Optional, quantization applied to the loaded model, see `ASRBackend.quantize`.
+        kwargs: Optional, passed on to the backend.
+
+    Returns:
+        `ASRBackend` instance.
+    """
+    if backend is None:
+        config = AutoConfig.from_pretrained(model_id)
+        architectures = config.architectures or []
+        if config.model_type == "whisper":
+            backend = "whisper"
+        elif any(architecture.endswith("ForCTC") for architecture in architectures):
+            backend = "ctc"
+        else:
+            raise ValueError(
+                f"Cannot detect the backend of `{model_id}` (model type `{config.model_type}`), "
+                f"pass one of {sorted(BACKENDS)}."
+            )
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend `{backend}`, expected one of {sorted(BACKENDS)}.")
+    asr_backend = BACKENDS[backend](model_id, **kwargs)
+    if quantization is not None:
+        asr_backend.quantize(quantization)
+    return asr_backend
+
+
+def warm_up(backend: ASRBackend, batches: list):
+    """
+    Transcribes a few batches without timing them, so lazy weight initialization, allocator growth and thread-pool
+    spin-up are kept out of the timed batches. The feature cache is left out, its hits would be counted.
+
+    Args:
+        backend: Backend to warm up.
+        batches: Batches of audio arrays.
+    """
+    feature_cache, backend.feature_cache = backend.feature_cache, None
+    try:
+        for audios in batches:
+            backend.transcribe(audios)
+    finally:
+        backend.feature_cache = feature_cache
+
+
+def transcribe_timed(backend: ASRBackend, audios: list, num_trials: int = 1):
+    """
+    Transcribes a batch and returns one entry per audio with the raw prediction and its per-sample timings.
+
+    The batch time is spread evenly over the samples, or by the time shares of the backend (e.g. of packed windows).
+    With several trials the batch is transcribed `num_trials` times: the per-sample timings are the medians over the
+    trials, and the transcription time of every trial is kept in `trial_times_s`.
+    """
+    minibatch_size = len(audios)
+    timers = []
+    for trial in range(num_trials):
+        timer = PhaseTimer()
+        if trial == 0:
+            backend.last_time_shares = None
+            pred_text = backend.transcribe(audios, timer)
+            # Later trials read the features the first trial wrote to the cache
+            feature_cache_hits = backend.feature_cache.last_hits if backend.feature_cache is not None else None
+            truncated = backend.last_truncated if backend.max_tokens_per_second is not None else None
+            # normalize by minibatch size since we want the per-sample time
+            shares = backend.last_time_shares or minibatch_size * [1 / minibatch_size]
+        else:
+            backend.transcribe(audios, timer)
+        timers.append(timer)
+
+    entries = []
+    for pred, share in zip(pred_text, shares):
+        trial_times = [timer.transcription_time() * share for timer in timers]
+        entry = {"pred_text": pred, "transcription_time_s": float(np.median(trial_times))}
+        # Phases a backend skips (e.g. the encoder in assisted generation) take no time
+        for name in TRANSCRIPTION_PHASES:
+            entry[f"time_{name}_s"] = float(np.median([timer.totals.get(name, 0.0) * share for timer in timers]))
+        if num_trials > 1:
+            entry["trial_times_s"] = trial_times
+        entries.append(entry)
+    if feature_cache_hits is not None:
+        for entry, hit in zip(entries, feature_cache_hits):
+            entry["mel_cache_hit"] = hit
+    if truncated is not None:
+        for entry, is_truncated in zip(entries, truncated):
+            entry["truncated"] = is_truncated
+    return entries
+
+
+def truncation_columns(results: dict):
+    """
+    Maps the `truncated` column of the benchmark results to the manifest field, when the generation is limited.
+    """
+    return {"truncated": results["truncated"]} if "truncated" in results else {}
@@ -0,0 +1,135 @@
+import time
+
+from datasets import Dataset
+from tqdm import tqdm
+
+
+def sequential_batches(num_samples: int, batch_size: int):
+    """
+    Splits sample indices into batches in dataset order (the behaviour of `dataset.map(..., batched=True)`).
+    """
+    return [list(range(start, min(start + batch_size, num_samples))) for start in range(0, num_samples, batch_size)]
+
+
+def bucket_batches(durations: list, max_batch_size: int, max_batch_seconds: float = None):
+    """
+    Groups sample indices into batches of similar duration.
+
+    Samples are sorted by duration and cut into consecutive batches, so every batch only has to be padded up to a
+    clip of about the same length as its other clips.
+
+    Args:
+        durations: Length of each audio sample in seconds.
+        max_batch_size: Maximum number of samples per batch.
+        max_batch_seconds: Optional, maximum padded audio per batch in seconds, i.e. the number of samples in the
+            batch times its longest clip. Batches of short clips can then hold more samples than batches of long ones.
+
+    Returns:
+        List of batches, each a list of indices into `durations`.
+    """
+    order = sorted(range(len(durations)), key=lambda idx: durations[idx])
+
+    batches = []
+    batch = []
+    for idx in order:
+        # samples come in ascending order, so the current sample is the longest of the batch
+        padded_length = (len(batch) + 1) * durations[idx]
+        if batch and (
+                len(batch) >= max_batch_size
+                or (max_batch_seconds is not None and padded_length > max_batch_seconds)
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def padded_seconds(durations: list, batches: list, pad_batches_to: int = None):
+    """
+    Total padding in seconds when every clip in a batch is padded to the longest clip of that batch.
+
+    Args:
+        durations: Length of each audio sample in seconds.
+        batches: List of batches, each a list of indices into `durations`.
+        pad_batches_to: Optional, batch size short batches are filled up to with copies of a clip. Those copies are
+            counted as padding entirely.
+
+    Returns:
+        Padding in seconds.
+    """
+    padding = 0.0
+    for batch in batches:
+        lengths = [durations[idx] for idx in batch]
+        num_slots = max(pad_batches_to or 0, len(batch))
+        padding += num_slots * max(lengths) - sum(lengths)
+    return padding
+
+
+def read_batch(dataset, batch_indices: list):
+    """
+    Reads the samples at `batch_indices` as a batch (dictionary of columns).
+    """
+    if isinstance(dataset, list):
+        samples = [dataset[idx] for idx in batch_indices]
+        return {key: [sample[key] for sample in samples] for key in samples[0]}
+    return dataset[batch_indices]
+
+
+def run_batches(dataset, batches: list, function, remove_columns: list = None):
+    """
+    Applies a batched function to the given batches and restores the original sample order.
+
+    Reading a batch decodes and resamples its audio; the time spent on it is passed to `function` in the
+    `time_decode_s` column, spread evenly over the samples, unless the samples already carry their decode time.
+
+    Args:
+        dataset: Dataset to read the batches from, or a list of samples (dictionaries) read from a streaming dataset.
+        batches: List of batches, each a list of indices into `dataset`.
+        function: Function taking and returning a batch (dictionary of columns), like the one passed to `dataset.map`.
+        remove_columns: Optional, columns to drop from the output.
+
+    Returns:
+        Dataset with the outputs of `function`, in the order of `dataset`.
+    """
+    remove_columns = set(remove_columns or [])
+    columns = {}
+    for batch_indices in tqdm(batches, desc="Batches..."):
+        start_time = time.perf_counter()
+        batch = read_batch(dataset, batch_indices)
+        decode_time = time.perf_counter() - start_time
+        if "time_decode_s" not in batch:
+            batch["time_decode_s"] = len(batch_indices) * [decode_time / len(batch_indices)]
+
+        batch = function(batch)
+        for key, values in batch.items():
+            if key in remove_columns:
+                continue
+            if key not in columns:
+                columns[key] = [None] * len(dataset)
+            for idx, value in zip(batch_indices, values):
+                columns[key][idx] = value
+
+    return Dataset.from_dict(columns)
+
+
+def print_padding_report(durations: list, batches: list, batch_size: int, padding=padded_seconds):
+    """
+    Prints the padding of the bucketed batches against batches taken in dataset order and filled up to `batch_size`.
+
+    Args:
+        durations: Length of each audio sample in seconds.
+        batches: List of bucketed batches, each a list of indices into `durations`.
+        batch_size: Batch size of the batches in dataset order.
+        padding: Optional, function computing the padding of batches like `padded_seconds`, e.g.
+            `ASRBackend.padded_seconds` for the padding a backend actually does.
+    """
+    baseline = padding(durations, sequential_batches(len(durations), batch_size), pad_batches_to=batch_size)
+    bucketed = padding(durations, batches)
+    saved = 100 * (baseline - bucketed) / baseline if baseline > 0 else 0.0
+    print(
+        f"Padding: {bucketed:.1f} s in {len(batches)} bucketed batches vs {baseline:.1f} s in dataset order "
+        f"({saved:.1f} % saved)"
+    )
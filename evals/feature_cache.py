@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+
+class FeatureCache:
+    """
+    Persistent cache of input features (e.g. Whisper log-mel spectrograms), keyed by audio content and feature
+    extractor config.
+
+    The features of one feature extractor config are rows of a single float32 file, read through a memory map, and an
+    SQLite index maps each audio hash to its row. Models with the same feature extractor (whisper-small, medium and
+    large-v2 with 80 mel bins) share these features, and several evaluation processes can fill the cache at once:
+    rows are reserved in the index, written, and only then marked as ready.
+    """
+
+    def __init__(self, cache_dir: str, feature_extractor):
+        config = feature_extractor.to_dict()
+        # The processor class differs between checkpoints with the same features
+        config.pop("processor_class", None)
+        config = json.dumps(config, sort_keys=True, default=str)
+        self.config_hash = hashlib.sha256(config.encode("utf-8")).hexdigest()
+
+        self.directory = os.path.join(cache_dir, self.config_hash[:16])
+        os.makedirs(self.directory, exist_ok=True)
+        self.features_path = os.path.join(self.directory, "features.f32")
+        open(self.features_path, "ab").close()
+
+        # The timeout lets several evaluation processes share one cache
+        self.connection = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), timeout=60)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS features (row INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, ready INTEGER)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS features_key ON features (key)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.connection.commit()
+
+        self.row_shape = None
+        self.rows = None
+        self.hits = 0
+        self.misses = 0
+        # Whether the features of each audio of the last batch came from the cache
+        self.last_hits = []
+
+    @staticmethod
+    def key(audio) -> str:
+        return hashlib.sha256(np.ascontiguousarray(audio, dtype=np.float32).tobytes()).hexdigest()
+
+    def load_row_shape(self):
+        if self.row_shape is None:
+            row = self.connection.execute("SELECT value FROM meta WHERE name = 'row_shape'").fetchone()
+            if row is not None:
+                self.row_shape = tuple(json.loads(row[0]))
+        return self.row_shape
+
+    def read_rows(self, rows: list):
+        """
+        Reads rows of the features file, mapping it again when other processes have appended rows since.
+        """
+        row_size = int(np.prod(self.row_shape))
+        if self.rows is None or max(rows) >= len(self.rows):
+            num_rows = os.path.getsize(self.features_path) // (4 * row_size)
+            self.rows = np.memmap(self.features_path, dtype=np.float32, mode="r", shape=(num_rows, *self.row_shape))
+        return self.rows[rows]
+
+    def get(self, keys: list):
+        """
+        Returns the row of each key, or None for keys that are not in the cache.
+        """
+        placeholders = ",".join("?" * len(keys))
+        found = dict(self.connection.execute(
+            f"SELECT key, row - 1 FROM features WHERE ready = 1 AND key IN ({placeholders})", keys
+        ))
+        return [found.get(key) for key in keys]
+
+    def put(self, keys: list, features):
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('row_shape', ?)",
+                                    (json.dumps(features.shape[1:]),))
+        if self.load_row_shape() != features.shape[1:]:
+            raise ValueError(f"Features of shape {features.shape[1:]} cannot be cached with rows of {self.row_shape}.")
+
+        # Rows are reserved first, so processes filling the cache at the same time write to different rows
+        with self.connection:
+            rows = [
+                self.connection.execute("INSERT INTO features (key, ready) VALUES (?, 0)", (key,)).lastrowid - 1
+                for key in keys
+            ]
+        with open(self.features_path, "r+b") as f:
+            for row, row_features in zip(rows, features):
+                f.seek(row * row_features.nbytes)
+                f.write(row_features.tobytes())
+        with self.connection:
+            self.connection.executemany("UPDATE features SET ready = 1 WHERE row = ?", [(row + 1,) for row in rows])
+
+    def features(self, arrays: list, extract):
+        """
+        Returns the features of a batch of audio arrays, only extracting the features of arrays that are not cached.
+
+        Args:
+            arrays: Audio arrays of the batch.
+            extract: Function turning a list of audio arrays into an array of features, one row per audio.
+
+        Returns:
+            Float32 array of features, in the order of `arrays`.
+        """
+        keys = [self.key(audio) for audio in arrays]
+        rows = self.get(keys) if self.load_row_shape() is not None else len(keys) * [None]
+        missing = [idx for idx, row in enumerate(rows) if row is None]
+        self.last_hits = [row is not None for row in rows]
+        self.hits += len(arrays) - len(missing)
+        self.misses += len(missing)
+
+        new_features = None
+        if len(missing) > 0:
+            new_features = np.asarray(extract([arrays[idx] for idx in missing]), dtype=np.float32)
+            self.put([keys[idx] for idx in missing], new_features)
+
+        features = np.empty((len(arrays), *self.row_shape), dtype=np.float32)
+        cached = [idx for idx, row in enumerate(rows) if row is not None]
+        if len(cached) > 0:
+            features[cached] = self.read_rows([rows[idx] for idx in cached])
+        if new_features is not None:
+            features[missing] = new_features
+        return features
+
+    def close(self):
+        self.connection.close()
+
+
+def feature_cache_columns(results: dict):
+    """
+    Maps the `mel_cache_hit` column of the benchmark results to the manifest field, when the feature cache is used.
+    Samples served by the prediction cache have no feature cache hit (None).
+    """
+    return {"mel_cache_hit": results["mel_cache_hit"]} if "mel_cache_hit" in results else {}
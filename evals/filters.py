@@ -0,0 +1,104 @@
+import json
+from collections import Counter
+
+import numpy as np
+
+
+class HallucinationFilter:
+    """
+    Drops hallucinated predictions, working on the prediction and reference columns at once.
+
+    Rules (a rule set to None is disabled):
+        max_length_ratio: drop predictions with more than `max_length_ratio` times the words of the reference.
+        max_ngram_repeats: drop predictions in which one n-gram of `ngram_size` words occurs more often than this, the
+            repeat loops Whisper falls into on child speech.
+        drop_empty: drop empty predictions.
+    """
+
+    def __init__(
+            self,
+            max_length_ratio: float = 2.0,
+            max_ngram_repeats: int = None,
+            ngram_size: int = 3,
+            drop_empty: bool = False,
+    ):
+        self.max_length_ratio = max_length_ratio
+        self.max_ngram_repeats = max_ngram_repeats
+        self.ngram_size = ngram_size
+        self.drop_empty = drop_empty
+
+    def __call__(self, references: list, predictions: list):
+        """
+        Returns the reason each sample is dropped for, or None for the samples that are kept.
+        """
+        reference_words = [reference.split() for reference in references]
+        prediction_words = [prediction.split() for prediction in predictions]
+        reference_lengths = np.array([len(words) for words in reference_words])
+        prediction_lengths = np.array([len(words) for words in prediction_words])
+
+        # rules are applied in order, the first matching rule is the reason a sample is dropped for
+        reasons = len(references) * [None]
+        undecided = np.ones(len(references), dtype=bool)
+
+        def drop(mask, reason):
+            for idx in np.flatnonzero(undecided & mask):
+                reasons[idx] = reason
+            undecided[mask] = False
+
+        if self.drop_empty:
+            drop(prediction_lengths == 0, "empty_output")
+        if self.max_length_ratio is not None:
+            drop(prediction_lengths > self.max_length_ratio * reference_lengths, "length_ratio")
+        if self.max_ngram_repeats is not None:
+            repeats = np.array([self.max_repeats(words) for words in prediction_words])
+            drop(repeats > self.max_ngram_repeats, "repeated_ngram")
+
+        return reasons
+
+    def max_repeats(self, words: list):
+        ngrams = Counter(tuple(words[i:i + self.ngram_size]) for i in range(len(words) - self.ngram_size + 1))
+        return max(ngrams.values(), default=0)
+
+
+def filter_results(results, hallucination_filter: HallucinationFilter, columns: list, start_index: int = 0):
+    """
+    Applies the filter to the benchmark results and collects the result columns of the kept samples.
+
+    Args:
+        results: Dataset returned by `run_batches`.
+        hallucination_filter: Filter deciding which samples are dropped.
+        columns: Result columns to collect.
+        start_index: Optional, dataset index of the first sample, used to identify streamed samples.
+
+    Returns:
+        Dictionary with the kept values of each column, and the dropped samples with the reason they were dropped for.
+    """
+    references = results["references"]
+    predictions = results["predictions"]
+    reasons = hallucination_filter(references, predictions)
+
+    keep = [idx for idx, reason in enumerate(reasons) if reason is None]
+    dropped = [
+        {"index": start_index + idx, "reason": reason, "text": references[idx], "pred_text": predictions[idx]}
+        for idx, reason in enumerate(reasons)
+        if reason is not None
+    ]
+
+    kept = results.select_columns([column for column in columns if column in results.column_names]).select(keep)
+    return {column: kept[column] for column in kept.column_names}, dropped
+
+
+def write_dropped(manifest_path: str, dropped: list, append: bool = False):
+    """
+    Writes the dropped samples next to the manifest, as `<manifest>.dropped.jsonl`, and returns its path.
+    """
+    dropped_path = manifest_path[:-len(".jsonl")] + ".dropped.jsonl"
+    with open(dropped_path, "a" if append else "w", encoding="utf-8") as f:
+        for datum in dropped:
+            f.write(f"{json.dumps(datum, ensure_ascii=False)}\n")
+    return dropped_path
+
+
+def summarize_dropped(dropped: list):
+    counts = Counter(datum["reason"] for datum in dropped)
+    return ", ".join(f"{reason} {count}" for reason, count in sorted(counts.items())) or "none"
@@ -0,0 +1,60 @@
+import time
+
+import numpy as np
+
+# Computed like the leaderboard, so the printed and the scored latencies agree
+from normalizer.eval_utils import latency_percentiles
+
+
+class ArrivalSchedule:
+    """
+    Arrival times of the requests of a latency run, served one at a time in arrival order.
+
+    Without an arrival rate, each request arrives as soon as the previous one is done, so its latency is its own
+    processing time. With an arrival rate, requests arrive as a Poisson process of `arrival_rate` requests per second
+    (exponential gaps between arrivals). A request arriving while an earlier one is processed waits for it, and that
+    wait counts towards its latency.
+    """
+
+    def __init__(self, arrival_rate: float = None, seed: int = 0):
+        self.arrival_rate = arrival_rate
+        self.rng = np.random.default_rng(seed)
+        self.start_time = None
+        self.next_arrival = 0.0
+
+    def wait(self):
+        """
+        Waits until the next request arrives and returns its arrival time (`time.perf_counter` clock).
+        """
+        now = time.perf_counter()
+        if self.arrival_rate is None:
+            return now
+
+        if self.start_time is None:
+            self.start_time = now
+        arrival = self.start_time + self.next_arrival
+        self.next_arrival += self.rng.exponential(1 / self.arrival_rate)
+        if arrival > now:
+            time.sleep(arrival - now)
+        return arrival
+
+
+def latency_model_key(model_key: str, arrival_rate: float = None):
+    """
+    Model id of the manifests of a latency run, e.g. `openai/whisper-small+latency` or
+    `openai/whisper-small+latency-2rps`, so latency runs don't overwrite the throughput runs of the model.
+    """
+    if arrival_rate is None:
+        return f"{model_key}+latency"
+    return f"{model_key}+latency-{arrival_rate:g}rps"
+
+
+def latency_columns(results: dict):
+    """
+    Maps the `latency_s` column of the benchmark results to the manifest field `latency`, in latency runs.
+    """
+    return {"latency": results["latency_s"]} if "latency_s" in results else {}
+
+
+def format_latencies(percentiles: dict):
+    return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in percentiles.items())
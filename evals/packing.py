@@ -0,0 +1,131 @@
+import numpy as np
+
+# Length of the Whisper input window in seconds
+WINDOW_SECONDS = 30.0
+
+
+class PackedWindow:
+    """
+    Utterances of a batch sharing one input window: the index of each utterance in the batch and its start and end
+    in the window, in seconds. Consecutive utterances are separated by `gap_seconds` of silence.
+    """
+
+    def __init__(self):
+        self.indices = []
+        self.spans = []
+
+    @property
+    def end(self):
+        return self.spans[-1][1] if len(self.spans) > 0 else 0.0
+
+    def add(self, idx: int, start: float, duration: float):
+        self.indices.append(idx)
+        self.spans.append((start, start + duration))
+
+
+def pack_windows(durations: list, gap_seconds: float, window_seconds: float = WINDOW_SECONDS):
+    """
+    Packs the utterances of a batch into as few windows as possible, in batch order: an utterance starts a new window
+    when it does not fit in the current one. Utterances longer than a window get a window of their own.
+
+    Args:
+        durations: Length of each utterance in seconds.
+        gap_seconds: Silence between consecutive utterances of a window in seconds.
+        window_seconds: Optional, length of a window in seconds.
+
+    Returns:
+        List of `PackedWindow`.
+    """
+    windows = []
+    window = None
+    for idx, duration in enumerate(durations):
+        start = window.end + gap_seconds if window is not None else 0.0
+        if window is None or start + duration > window_seconds:
+            window = PackedWindow()
+            windows.append(window)
+            start = 0.0
+        window.add(idx, start, duration)
+    return windows
+
+
+def join_window(arrays: list, window: PackedWindow, gap_seconds: float, sampling_rate: int = 16_000):
+    """
+    Joins the audio arrays of the utterances of a window, with silence in between.
+    """
+    gap = np.zeros(int(round(gap_seconds * sampling_rate)), dtype=np.float32)
+    pieces = []
+    for idx in window.indices:
+        if len(pieces) > 0:
+            pieces.append(gap)
+        pieces.append(np.asarray(arrays[idx], dtype=np.float32))
+    return np.concatenate(pieces)
+
+
+def overlaps(window: PackedWindow, start: float, end: float):
+    """
+    Overlap in seconds of a segment of the transcription with each utterance of a window. A segment without an end
+    timestamp (e.g. cut off by the token budget) runs up to the end of the window.
+    """
+    end = window.end if end is None else max(end, start)
+    return [max(min(end, span_end) - max(start, span_start), 0.0) for span_start, span_end in window.spans]
+
+
+def crosses_gap(window: PackedWindow, segments: list):
+    """
+    Whether a segment of the transcription overlaps several utterances of the window, i.e. runs across a gap.
+    """
+    return any(
+        sum(overlap > 0 for overlap in overlaps(window, start, end)) > 1 for start, end, _ in segments
+    )
+
+
+def assign_segments(window: PackedWindow, segments: list):
+    """
+    Splits the transcription of a window back into the transcriptions of its utterances.
+
+    Each segment (a sentence of timestamp tokens, or a single word with token-level timestamps) goes to the utterance
+    it overlaps the most, or the nearest utterance when it falls in a gap. Whisper does not always end a segment at a
+    gap, segments across a gap are only split correctly at the word level, see `crosses_gap`.
+
+    Args:
+        window: Packed window.
+        segments: `(start, end, text)` of each segment of the transcription, times in seconds relative to the window.
+
+    Returns:
+        Transcription of each utterance of the window, in window order.
+    """
+    texts = [[] for _ in window.indices]
+    for start, end, text in segments:
+        segment_overlaps = overlaps(window, start, end)
+        middle = (start + (window.end if end is None else max(end, start))) / 2
+        position = min(
+            range(len(window.spans)),
+            key=lambda position: (-segment_overlaps[position], abs(middle - sum(window.spans[position]) / 2)),
+        )
+        texts[position].append(text.strip())
+    return [" ".join(text for text in utterance if text) for utterance in texts]
+
+
+def unpack(values: list, windows: list, num_utterances: int):
+    """
+    Maps per-window values (e.g. whether the generation was truncated) to the utterances of each window.
+    """
+    utterance_values = num_utterances * [None]
+    for value, window in zip(values, windows):
+        for idx in window.indices:
+            utterance_values[idx] = value
+    return utterance_values
+
+
+def time_shares(windows: list):
+    """
+    Share of the batch transcription time of each utterance: every window costs the same (a full window is encoded),
+    and the time of a window is split over its utterances by duration.
+    """
+    shares = [None] * sum(len(window.indices) for window in windows)
+    for window in windows:
+        durations = np.array([end - start for start, end in window.spans], dtype=np.float64)
+        weights = durations / durations.sum() if durations.sum() > 0 else np.full(len(durations), 1 / len(durations))
+        for idx, weight in zip(window.indices, weights):
+            shares[idx] = float(weight) / len(windows)
+    return shares
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+
+class PredictionCache:
+    """
+    Persistent cache of raw model predictions, keyed by model id, generation config and audio content.
+
+    Entries are committed as soon as a batch is transcribed, so a re-run only transcribes the samples that are not in
+    the cache yet and an interrupted run continues from its last finished batch. The key does not cover the threads,
+    batch size or machine, cached predictions are not timed again and are left out of the RTFx.
+    """
+
+    def __init__(self, path: str, model_id: str, generation_config: dict):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # The timeout lets several evaluation processes share one cache file
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, model_id TEXT, entry TEXT)")
+        self.connection.commit()
+
+        self.model_id = model_id
+        config = json.dumps({"model_id": model_id, "generation_config": generation_config}, sort_keys=True, default=str)
+        self.config_hash = hashlib.sha256(config.encode("utf-8")).hexdigest()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, audio) -> str:
+        audio_hash = hashlib.sha256(np.ascontiguousarray(audio, dtype=np.float32).tobytes()).hexdigest()
+        return hashlib.sha256(f"{self.config_hash}:{audio_hash}".encode("utf-8")).hexdigest()
+
+    def get(self, keys: list):
+        """
+        Returns the cached entry for each key, or None for keys that are not in the cache.
+        """
+        placeholders = ",".join("?" * len(keys))
+        rows = self.connection.execute(f"SELECT key, entry FROM predictions WHERE key IN ({placeholders})", keys)
+        found = {key: json.loads(entry) for key, entry in rows}
+        return [found.get(key) for key in keys]
+
+    def put(self, keys: list, entries: list):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO predictions (key, model_id, entry) VALUES (?, ?, ?)",
+                [(key, self.model_id, json.dumps(entry, ensure_ascii=False)) for key, entry in zip(keys, entries)],
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+def transcribe_with_cache(cache, audios: list, transcribe):
+    """
+    Returns one entry per audio, transcribing only the audios that are not in the cache.
+
+    Args:
+        cache: `PredictionCache`, or None to transcribe every audio.
+        audios: Audio arrays of the batch.
+        transcribe: Function transcribing a list of audio arrays into a list of entries (dictionaries with the raw
+            prediction and per-sample timings).
+
+    Returns:
+        List of entries, in the order of `audios`, flagged with `prediction_cached`. Entries read from the cache have no
+        timings (None), they were not transcribed by this run.
+    """
+    if cache is None:
+        return transcribe(audios)
+
+    keys = [cache.key(audio) for audio in audios]
+    entries = cache.get(keys)
+    missing = [idx for idx, entry in enumerate(entries) if entry is None]
+    for entry in entries:
+        if entry is not None:
+            entry["prediction_cached"] = True
+            for name in entry:
+                if name == "transcription_time_s" or name.startswith("time_"):
+                    entry[name] = None
+    cache.hits += len(audios) - len(missing)
+    cache.misses += len(missing)
+
+    if len(missing) > 0:
+        new_entries = transcribe([audios[idx] for idx in missing])
+        cache.put([keys[idx] for idx in missing], new_entries)
+        for idx, entry in zip(missing, new_entries):
+            entries[idx] = dict(entry, prediction_cached=False)
+
+    return entries
+
+
+def prediction_cache_columns(results: dict):
+    """
+    Maps the `prediction_cached` column of the benchmark results to the manifest field, when the prediction cache is
+    used.
+    """
+    return {"prediction_cached": results["prediction_cached"]} if "prediction_cached" in results else {}
+
+
+def timed_totals(durations: list, times: list):
+    """
+    Audio length and transcription time in seconds summed over the timed samples, i.e. without the samples served by
+    the prediction cache (no time).
+    """
+    timed = [(duration, time) for duration, time in zip(durations, times) if time is not None]
+    return sum(duration for duration, _ in timed), sum(time for _, time in timed)
+
+
+def warn_cached(num_cached: int):
+    if num_cached > 0:
+        print(f"Warning: {num_cached} samples were served by the prediction cache and not timed by this run, the "
+              f"RTFx and the time per phase only cover the transcribed samples.")
@@ -0,0 +1,29 @@
+import time
+from itertools import islice
+
+
+def stream_windows(samples, window_size: int):
+    """
+    Reads samples lazily from an iterable (e.g. a streaming `IterableDataset`) in windows of `window_size` samples.
+
+    Only one window is held in memory at a time, so memory stays flat however large the dataset is. Samples are
+    decoded while they are read; the time spent on it is stored per sample in `time_decode_s`.
+
+    Args:
+        samples: Iterable of samples (dictionaries).
+        window_size: Number of samples per window.
+
+    Yields:
+        Lists of samples, in the order of `samples`.
+    """
+    iterator = iter(samples)
+    while True:
+        start_time = time.perf_counter()
+        window = list(islice(iterator, window_size))
+        if len(window) == 0:
+            return
+
+        decode_time = (time.perf_counter() - start_time) / len(window)
+        for sample in window:
+            sample["time_decode_s"] = decode_time
+        yield window
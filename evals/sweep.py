@@ -0,0 +1,117 @@
+import argparse
+import importlib
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _init_worker(num_threads: int):
+    # Each worker gets its share of the cores, so the workers don't oversubscribe the CPU
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["MKL_NUM_THREADS"] = str(num_threads)
+
+    import torch
+    torch.set_num_threads(num_threads)
+
+
+def _run_job(runner: str, args):
+    start_time = time.perf_counter()
+    manifest_path = importlib.import_module(runner).main(args)
+    return manifest_path, time.perf_counter() - start_time
+
+
+def run_sweep(runner: str, jobs: list, num_workers: int = None, num_threads: int = None):
+    """
+    Runs evaluation jobs in a pool of worker processes and collects their manifests.
+
+    Every job runs in a fresh process, so the memory of a model is released when its job is done. With one worker the
+    jobs run one after another in the current process.
+
+    Args:
+        runner: Name of the evaluation module whose `main(args)` runs a job, i.e. "eval" or "auris_eval".
+        jobs: Arguments of each job, as parsed by the `get_parser()` of the runner.
+        num_workers: Optional, number of jobs running at the same time. Defaults to one job per core, at most one
+            worker per job.
+        num_threads: Optional, number of torch threads per worker. Defaults to the cores divided over the workers.
+
+    A failing job does not stop the sweep: its error is reported after the other jobs are done.
+
+    Returns:
+        Paths of the manifests written by the jobs that succeeded, in the order of `jobs`.
+    """
+    num_cores = os.cpu_count() or 1
+    if num_workers is None:
+        num_workers = min(len(jobs), num_cores)
+    num_workers = max(1, min(num_workers, len(jobs)))
+    if num_threads is None:
+        num_threads = max(1, num_cores // num_workers)
+
+    print(f"Sweep: {len(jobs)} jobs on {num_workers} workers with {num_threads} threads each")
+    start_time = time.perf_counter()
+
+    # Output of each job, or None if it failed, and the error of each failed job
+    outputs = []
+    failures = []
+    if num_workers == 1:
+        for args in jobs:
+            try:
+                outputs.append(_run_job(runner, args))
+            except Exception as error:
+                outputs.append(None)
+                failures.append((args, error))
+    else:
+        with ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(num_threads,),
+                max_tasks_per_child=1,
+        ) as executor:
+            futures = [executor.submit(_run_job, runner, args) for args in jobs]
+            for args, future in zip(jobs, futures):
+                try:
+                    outputs.append(future.result())
+                except Exception as error:
+                    outputs.append(None)
+                    failures.append((args, error))
+
+    wall_time = time.perf_counter() - start_time
+    outputs = [output for output in outputs if output is not None]
+    job_time = sum(elapsed for _, elapsed in outputs)
+    print("*" * 80)
+    for manifest_path, elapsed in outputs:
+        # Jobs on an empty dataset write no manifest
+        print(f"{os.path.basename(manifest_path) if manifest_path is not None else 'no results'}: {elapsed:.1f} s")
+    print(f"Sweep took {wall_time:.1f} s for {job_time:.1f} s of jobs")
+
+    for args, error in failures:
+        print("*" * 80)
+        print(f"Job failed: {args.model_id} on {args.dataset}")
+        traceback.print_exception(type(error), error, error.__traceback__)
+    if len(failures) > 0:
+        print(f"{len(failures)} of {len(jobs)} jobs failed")
+
+    return [manifest_path for manifest_path, _ in outputs if manifest_path is not None]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluates every model on every dataset. Arguments not listed here are passed on to the runner."
+    )
+    parser.add_argument("--runner", type=str, default="eval", choices=["eval", "auris_eval"])
+    parser.add_argument("--model_ids", type=str, nargs="+", required=True)
+    parser.add_argument("--datasets", type=str, nargs="+", required=True,
+                        help="Subsets of `--dataset_path` for `eval`, dataset directories for `auris_eval`.")
+    parser.add_argument("--num_workers", type=int, default=None)
+    parser.add_argument("--num_threads", type=int, default=None)
+    args, runner_argv = parser.parse_known_args()
+
+    runner_parser = importlib.import_module(args.runner).get_parser()
+    jobs = [
+        runner_parser.parse_args(runner_argv + ["--model_id", model_id, "--dataset", dataset])
+        for model_id in args.model_ids
+        for dataset in args.datasets
+    ]
+    run_sweep(args.runner, jobs, num_workers=args.num_workers, num_threads=args.num_threads)
@@ -0,0 +1,92 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+# Computed like the leaderboard, so the printed and the scored RTFx agree
+from normalizer.eval_utils import trial_rtfx_stats
+
+# Phases of the benchmark, in pipeline order
+PHASES = ["decode", "mel", "encoder", "generate", "detokenize", "normalize"]
+
+# Phases that count towards the transcription time (and therefore RTFx)
+TRANSCRIPTION_PHASES = ["mel", "encoder", "generate", "detokenize"]
+
+
+class PhaseTimer:
+    """
+    Accumulates wall-clock time per benchmark phase with a high resolution clock.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] += time.perf_counter() - start
+
+    def transcription_time(self):
+        return sum(self.totals.get(name, 0.0) for name in TRANSCRIPTION_PHASES)
+
+    def sample_times(self, minibatch_size: int):
+        """
+        Returns the per-sample `time_<phase>_s` values of each timed phase, spreading it evenly over the samples.
+        """
+        return {f"time_{name}_s": seconds / minibatch_size for name, seconds in self.totals.items()}
+
+    def per_sample(self, batch: dict, minibatch_size: int):
+        """
+        Adds one `time_<phase>_s` column per timed phase to `batch`, spreading each phase evenly over the samples.
+        """
+        for key, seconds in self.sample_times(minibatch_size).items():
+            batch[key] = minibatch_size * [seconds]
+        return batch
+
+
+def phase_columns(results: dict):
+    """
+    Maps the `time_<phase>_s` columns of the benchmark results to the manifest fields `time_<phase>`.
+    """
+    return {f"time_{name}": results[f"time_{name}_s"] for name in PHASES if f"time_{name}_s" in results}
+
+
+def trial_columns(results: dict):
+    """
+    Maps the `trial_times_s` column of the benchmark results to the manifest field `trial_times`, when the batches
+    were timed over several trials.
+    """
+    return {"trial_times": results["trial_times_s"]} if "trial_times_s" in results else {}
+
+
+def trial_throughput(durations: list, trial_times: list):
+    """
+    Median and p95 RTFx over the timed trials.
+
+    Each trial's RTFx is the total audio length over the total transcription time of that trial. The p95 RTFx is the
+    throughput reached by 95 % of the trials, i.e. the RTFx of the trial at the 95th percentile of transcription time.
+
+    Args:
+        durations: Length of each audio sample in seconds.
+        trial_times: Transcription time of each sample in each trial, one list of trials per sample.
+
+    Returns:
+        Median and p95 RTFx, or None if any sample lacks trial times.
+    """
+    if len(trial_times) == 0 or any(times is None for times in trial_times):
+        return None
+    if len(set(len(times) for times in trial_times)) > 1:
+        return None
+    return trial_rtfx_stats(sum(durations), np.sum(trial_times, axis=0))
+
+
+def format_phase_times(phase_times: dict):
+    total = sum(phase_times.values())
+    return ", ".join(
+        f"{name} {seconds:.2f} s ({100 * seconds / total:.1f} %)" if total > 0 else f"{name} {seconds:.2f} s"
+        for name, seconds in phase_times.items()
+    )
@@ -0,0 +1,80 @@
+import argparse
+import glob
+import re
+import time
+
+import regex
+
+from .eval_utils import read_manifest
+from .normalizer import BasicTextNormalizer
+
+
+def reference_normalize(normalizer: BasicTextNormalizer, s: str):
+    """
+    `BasicTextNormalizer.__call__` before it was compiled: `re.sub` passes and the per-character `clean` generator.
+    """
+    s = s.lower()
+    s = re.sub(r"[<\[][^>\]]*[>\]]", "", s)  # remove words between brackets
+    s = re.sub(r"\(([^)]+?)\)", "", s)  # remove words between parenthesis
+    s = normalizer.clean(s).lower()
+
+    if normalizer.split_letters:
+        s = " ".join(regex.findall(r"\X", s, regex.U))
+
+    s = re.sub(r"\s+", " ", s)  # replace any successive whitespace characters with a space
+
+    return s
+
+
+def read_texts(directory: str):
+    """
+    Returns the references and predictions of every result file in a directory.
+    """
+    texts = []
+    for result_file in sorted(glob.glob(f"{directory}/**/*.jsonl", recursive=True)):
+        for datum in read_manifest(result_file):
+            texts += [datum["text"], datum["pred_text"]]
+    return texts
+
+
+def run_benchmark(texts: list, remove_diacritics: bool = False, split_letters: bool = False):
+    normalizer = BasicTextNormalizer(remove_diacritics=remove_diacritics, split_letters=split_letters)
+
+    start_time = time.perf_counter()
+    expected = [reference_normalize(normalizer, s) for s in texts]
+    reference_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    compiled = [normalizer(s) for s in texts]
+    compiled_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch = normalizer.normalize_batch(texts)
+    batch_time = time.perf_counter() - start_time
+
+    mismatches = sum(e != c for e, c in zip(expected, compiled)) + sum(e != b for e, b in zip(expected, batch))
+    print(
+        f"remove_diacritics={remove_diacritics}, split_letters={split_letters}: "
+        f"reference {reference_time:.2f} s, compiled {compiled_time:.2f} s ({reference_time / compiled_time:.1f}x), "
+        f"normalize_batch {batch_time:.2f} s ({reference_time / batch_time:.1f}x), mismatches {mismatches}"
+    )
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks that the compiled normalizer matches the reference normalizer on every reference and "
+                    "prediction in the result files, and times both."
+    )
+    parser.add_argument("--results_dir", type=str, default="results/")
+    args = parser.parse_args()
+
+    texts = read_texts(args.results_dir)
+    print(f"{len(texts)} texts, {len(set(texts))} unique")
+    mismatches = sum(
+        run_benchmark(texts, remove_diacritics=remove_diacritics, split_letters=split_letters)
+        for remove_diacritics in [False, True]
+        for split_letters in [False, True]
+    )
+    if mismatches > 0:
+        raise SystemExit(f"The compiled normalizer differs from the reference on {mismatches} texts.")
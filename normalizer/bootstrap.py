@@ -0,0 +1,73 @@
+import numpy as np
+
+
+def resampled_sums(values, num_resamples: int = 1000, seed: int = 0, chunk_cells: int = 1 << 24):
+    """
+    Sums of the per-utterance values over bootstrap resamples of the utterances, all resamples drawn at once.
+
+    Each resample draws `n` utterances with replacement. The draws are turned into one count per utterance
+    (`np.bincount` over all resamples), so the sums of every resample are a single matrix product.
+
+    Args:
+        values: Array of shape (n, k), k per-utterance values (e.g. errors, reference words, durations, times).
+        num_resamples: Optional, number of bootstrap resamples.
+        seed: Optional, seed of the random generator, the same seed gives the same resamples for the same `n`.
+        chunk_cells: Optional, maximum size of the count matrix held in memory at once.
+
+    Returns:
+        Array of shape (num_resamples, k) with the sums of each resample.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    num_utterances = values.shape[0]
+    rng = np.random.default_rng(seed)
+
+    sums = []
+    chunk_size = max(1, chunk_cells // max(1, num_utterances))
+    for start in range(0, num_resamples, chunk_size):
+        size = min(chunk_size, num_resamples - start)
+        draws = rng.integers(0, num_utterances, size=(size, num_utterances))
+        offsets = (np.arange(size) * num_utterances)[:, None]
+        counts = np.bincount((draws + offsets).ravel(), minlength=size * num_utterances)
+        sums.append(counts.reshape(size, num_utterances) @ values)
+    return np.concatenate(sums, axis=0)
+
+
+def percentile_interval(samples, confidence: float = 0.95):
+    """
+    Percentile confidence interval of bootstrap samples.
+    """
+    alpha = (1 - confidence) / 2
+    lower, upper = np.nanquantile(samples, [alpha, 1 - alpha])
+    return float(lower), float(upper)
+
+
+def bootstrap_run(utterances: dict, num_resamples: int = 1000, seed: int = 0):
+    """
+    Resamples the utterances of one run and returns the resampled WER and RTFx.
+
+    Args:
+        utterances: Per-utterance `errors` and `words` (reference words), and `duration` and `time` when the RTFx can
+            be computed, as stored by `score_manifest`.
+
+    Returns:
+        Dictionary with the resampled `wer` (in percent) and `rtfx`, one value per resample, and the resampled
+        `duration` and `time` sums used for composite RTFx. RTFx entries are None without timings.
+    """
+    columns = ["errors", "words"]
+    if utterances.get("duration") is not None:
+        columns += ["duration", "time"]
+    values = np.stack([np.asarray(utterances[column], dtype=np.float64) for column in columns], axis=1)
+    sums = resampled_sums(values, num_resamples=num_resamples, seed=seed)
+
+    # a resample without reference words has no WER, these resamples are left out of the interval
+    with np.errstate(divide="ignore", invalid="ignore"):
+        resampled = {"wer": 100 * sums[:, 0] / sums[:, 1], "duration": None, "time": None, "rtfx": None}
+        if "duration" in columns:
+            resampled.update(duration=sums[:, 2], time=sums[:, 3], rtfx=sums[:, 2] / sums[:, 3])
+    return resampled
+
+
+def format_interval(interval):
+    if interval is None:
+        return ""
+    return f"[{interval[0]:0.2f}, {interval[1]:0.2f}]"
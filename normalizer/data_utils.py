@@ -1,4 +1,5 @@
-from datasets import load_dataset, Audio
+from datasets import load_dataset, Audio, Features, IterableDataset, Value
+from datasets.fingerprint import Hasher
 from normalizer import BasicTextNormalizer
 
 from .eval_utils import read_manifest, write_manifest
@@ -6,9 +7,28 @@ from .eval_utils import read_manifest, write_manifest
 normalizer = BasicTextNormalizer()
 
 
-def normalize(batch):
-    batch["norm_text"] = normalizer(batch["transcript"])
-    return batch
+def normalize(transcripts):
+    return {"norm_text": normalizer.normalize_batch(transcripts)}
+
+
+def normalize_transcripts(dataset, num_proc: int = None):
+    """
+    Adds the normalized transcripts in batches, using `num_proc` processes.
+
+    The normalized column only depends on the transcripts and the normalizer config, so its fingerprint is derived from
+    these: the first model of a sweep writes it to the dataset cache and the other models load it from there.
+    """
+    if isinstance(dataset, IterableDataset):
+        # Streamed samples are normalized on the fly, there is no cache to reuse. The features are passed on, so the
+        # audio column can still be cast afterwards.
+        features = None
+        if dataset.features is not None:
+            features = Features({**dataset.features, "norm_text": Value("string")})
+        return dataset.map(normalize, batched=True, input_columns=["transcript"], features=features)
+
+    fingerprint = Hasher.hash([dataset._fingerprint, "norm_text", normalizer.config()])
+    return dataset.map(normalize, batched=True, input_columns=["transcript"], num_proc=num_proc,
+                       new_fingerprint=fingerprint, desc="Normalizing transcripts")
 
 
 def load_data(args):
@@ -16,16 +36,19 @@ def load_data(args):
         args.dataset_path,
         args.dataset,
         token=True,
+        streaming=args.streaming,
     )
 
     return dataset
 
 
-def prepare_data(dataset):
-    # Step 1: Resample audio
-    dataset = dataset['train'].cast_column("audio", Audio(sampling_rate=16_000))
+def prepare_data(dataset, num_proc: int = None):
+    dataset = dataset['train']
+
+    # Step 1: Normalize transcripts (optional), before the audio column is decoded
+    dataset = normalize_transcripts(dataset, num_proc=num_proc)
 
-    # Step 3: Normalize transcripts (optional)
-    dataset = dataset.map(normalize)
+    # Step 2: Resample audio
+    dataset = dataset.cast_column("audio", Audio(sampling_rate=16_000))
 
     return dataset
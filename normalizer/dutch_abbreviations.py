@@ -1,41 +1,9 @@
-dutch_spelling_normalizer = {
-    "ander": "andere",
-    "bal": "baal",
-    "bal": "balk",
-    "bal": "ballen",
-    "bloem": "bloemen",
-    "bloemetje": "gloemtje",
-    "danser": "danseres",
-    "de": "   die",
-    "geef": "geeft",
-    "geven": "gegeven",
-    "ging": "gingen",
-    "hand": "handen",
-    "heks": "hek",
-    "heks": "heksen",
-    "heks": "heps",
-    "heks": "reks",
-    "heks": "erks",
-    "ijsje": "ijs",
-    "ijsje": "eisje",
-    "indiaan": "indienaar",
-    "indiaan": "indiën",
-    "klimmen": "klimmerek",
-    "kraan": "krant",
-    "nest": "net",
-    "nest": "netje",
-    "nu": "nou",
-    "pakt": "pakte",
-    "piraat": "piraten",
-    "piraat": "pirat",
-    "plant": "plantjes",
-    "plant": "plans",
-    "ridder": "rijder",
-    "ridder": "redder",
-    "schopt": "schot",
-    "stopt": "stopte",
-    "trap": "trappen",
-    "vangt": "afvangt",
-    "wacht": "wachten",
-    "zette": "zatte",
-}
+import os
+
+from .variants import load_variant_lexicon
+
+# Spelling variants of Dutch child speech, one `<variant>\t<canonical>` pair per line
+DUTCH_SPELLING_VARIANTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dutch_spelling_variants.tsv")
+
+# Maps every variant to its canonical spelling, e.g. "heps" -> "heks"
+dutch_spelling_normalizer = load_variant_lexicon(DUTCH_SPELLING_VARIANTS)
@@ -1,11 +1,21 @@
 import os
 import glob
 import json
+import zlib
 
-import evaluate
+import numpy as np
 import pandas as pd
+import pyarrow.compute as pc
 from collections import defaultdict
 
+from .bootstrap import bootstrap_run, format_interval, percentile_interval
+from .results_store import open_results, read_results, write_results
+from .score_cache import ScoreCache
+from .wer import corpus_counts, utterance_counts, word_error_rate
+
+# Latency percentiles reported for latency runs
+LATENCY_PERCENTILES = [50, 90, 99]
+
 
 def read_manifest(manifest_path: str):
     """
@@ -28,10 +38,16 @@ def write_manifest(
         dataset_name: str,
         audio_length: list = None,
         transcription_time: list = None,
+        extra_fields: dict = None,
+        append: bool = False,
+        start_index: int = 0,
+        results_store: str = "./results_store/",
 ):
     """
     Writes a manifest file (jsonl format) and returns the path to the file.
 
+    The samples are also written to the partition of the model and dataset in the Parquet results store.
+
     Args:
         references: Ground truth reference texts.
         transcriptions: Model predicted transcriptions.
@@ -40,10 +56,15 @@ def write_manifest(
         dataset_name: Name of the dataset.
         audio_length: Length of each audio sample in seconds.
         transcription_time: Transcription time of each sample in seconds.
+        extra_fields: Optional, additional per-sample fields, mapping the field name to one value per sample.
+        append: Optional, append the samples to an existing manifest instead of overwriting it.
+        start_index: Optional, index of the first sample, used to number appended samples.
+        results_store: Optional, root directory of the results store, None to only write the manifest.
 
     Returns:
         Path to the manifest file.
     """
+    model_key = model_id
     model_id = model_id.replace("/", "-")
     dataset_path = dataset_path.replace("/", "-")
     dataset_name = dataset_name.replace("/", "-")
@@ -65,6 +86,14 @@ def write_manifest(
             f"must match `references` ({len(references)})."
         )
 
+    extra_fields = extra_fields if extra_fields is not None else {}
+    for key, values in extra_fields.items():
+        if len(values) != len(references):
+            raise ValueError(
+                f"The number of samples in `{key}` ({len(values)}) "
+                f"must match `references` ({len(references)})."
+            )
+
     audio_length = (
         audio_length if audio_length is not None else len(references) * [None]
     )
@@ -82,44 +111,187 @@ def write_manifest(
         basedir, f"MODEL_{model_id}_DATASET_{dataset_path}_{dataset_name}.jsonl"
     )
 
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        for idx, (text, transcript, audio_length, transcription_time) in enumerate(
-                zip(references, transcriptions, audio_length, transcription_time)
+    with open(manifest_path, "a" if append else "w", encoding="utf-8") as f:
+        for idx, (text, transcript, sample_length, sample_time) in enumerate(
+                zip(references, transcriptions, audio_length, transcription_time), start=start_index
         ):
             datum = {
                 "audio_filepath": f"sample_{idx}",  # dummy value for Speech Data Processor
-                "duration": audio_length,
-                "time": transcription_time,
+                "duration": sample_length,
+                "time": sample_time,
                 "text": text,
                 "pred_text": transcript,
             }
+            for key, values in extra_fields.items():
+                datum[key] = values[idx - start_index]
             f.write(f"{json.dumps(datum, ensure_ascii=False)}\n")
+
+    if results_store is not None:
+        write_results(
+            results_store,
+            model_key,
+            f"{dataset_path}_{dataset_name}",
+            {"duration": audio_length, "time": transcription_time, "text": references, "pred_text": transcriptions,
+             **extra_fields},
+            metadata={"manifest_path": manifest_path},
+            append=append,
+            start_index=start_index,
+        )
     return manifest_path
 
 
-def score_results(directory: str, model_id: str = None, DEBUG: bool = False):
+def parse_filepath(fp: str):
     """
-    Scores all result files in a directory and returns a composite score over all evaluated datasets.
+    Parses the path of a result file and extracts the model id and the dataset id (dataset path, name and split).
+    """
+    model_index = fp.find("MODEL_")
+    fp = fp[model_index:]
+    ds_index = fp.find("DATASET_")
+    model_id = fp[:ds_index].replace("MODEL_", "").rstrip("_")
+    author_index = model_id.find("-")
+    model_id = model_id[:author_index] + "/" + model_id[author_index + 1:]
 
-    Args:
-        directory: Path to the result directory, containing one or more jsonl files.
-        model_id: Optional, model name to filter out result files based on model name.
-        DEBUG: Optional, printing scores
+    ds_fp = fp[ds_index:]
+    dataset_id = ds_fp.replace("DATASET_", "").rstrip(".jsonl")
+    return model_id, dataset_id
+
+
+def import_result_files(directory: str, store_dir: str = "./results_store/"):
+    """
+    Writes the result files of a directory, written before the results store existed, to the results store.
+    """
+    result_files = sorted(glob.glob(f"{directory}/**/*.jsonl", recursive=True))
+    for result_file in result_files:
+        if result_file.endswith(".dropped.jsonl"):
+            continue
+        manifest = read_manifest(result_file)
+        model_id, dataset_id = parse_filepath(result_file)
+        columns = {key: [datum.get(key) for datum in manifest] for key in manifest[0] if key != "audio_filepath"}
+        write_results(store_dir, model_id, dataset_id, columns, metadata={"manifest_path": result_file})
+
+
+def score_manifest(manifest: list, num_proc: int = 1):
+    """
+    Scores the samples of one result file.
 
     Returns:
-        Composite score over all evaluated datasets and a dictionary of all results.
+        Dictionary with the WER, its error counts, the audio length and inference time sums, the RTFx, the median
+        and p95 RTFx over the timed trials, the latency percentiles of latency runs, the scores without the samples
+        cut off by the token budget, the per-phase timing breakdown and the per-utterance arrays resampled by the
+        bootstrap.
+    """
+    references = [datum["text"] for datum in manifest]
+    predictions = [datum["pred_text"] for datum in manifest]
+
+    # Samples served by the prediction cache were not timed by the run, they are left out of the RTFx (zero duration and
+    # time in the per-utterance arrays)
+    timed = [not datum.get("prediction_cached") for datum in manifest]
+    time = [datum["time"] if is_timed else 0.0 for datum, is_timed in zip(manifest, timed)]
+    duration = [datum["duration"] if is_timed else 0.0 for datum, is_timed in zip(manifest, timed)]
+    compute_rtfx = any(timed) and all(
+        datum["time"] and datum["duration"] for datum, is_timed in zip(manifest, timed) if is_timed
+    )
 
+    # Hits, substitutions, deletions and insertions of every utterance, the WER is computed from their sums
+    counts = utterance_counts(references, predictions, num_proc=num_proc)
+    wer = word_error_rate(counts)
+    wer = round(100 * wer, 2)
+
+    if compute_rtfx:
+        audio_length = sum(duration)
+        inference_time = sum(time)
+        rtfx = round(sum(duration) / sum(time), 4)
+    else:
+        audio_length = inference_time = rtfx = None
+
+    # Median and p95 RTFx over the timed trials, when every sample was timed over the same number of trials. The p95
+    # RTFx is the throughput reached by 95 % of the trials.
+    trial_times = [datum.get("trial_times") for datum in manifest]
+    trial_time_sums = rtfx_median = rtfx_p95 = None
+    if compute_rtfx and len(manifest) > 0 and all(times is not None for times in trial_times):
+        if len(set(len(times) for times in trial_times)) == 1:
+            trial_time_sums = np.sum(trial_times, axis=0).tolist()
+            rtfx_median, rtfx_p95 = trial_rtfx_stats(audio_length, trial_time_sums)
+
+    # Per-request latencies, written by latency runs
+    latencies = [datum.get("latency") for datum in manifest]
+    has_latency = len(manifest) > 0 and all(latency is not None for latency in latencies)
+
+    # Per-phase timing breakdown, summed over the `time_<phase>` fields written by the benchmark for the timed samples
+    phase_times = {}
+    timed_manifest = [datum for datum, is_timed in zip(manifest, timed) if is_timed]
+    for key in (timed_manifest[0] if len(timed_manifest) > 0 else {}):
+        if key.startswith("time_") and all(datum.get(key) is not None for datum in timed_manifest):
+            phase_times[key[len("time_"):]] = sum(datum[key] for datum in timed_manifest)
+
+    # Per-utterance errors and reference words, and timings when the RTFx can be computed
+    utterances = {
+        "errors": counts["substitutions"] + counts["deletions"] + counts["insertions"],
+        "words": counts["substitutions"] + counts["deletions"] + counts["hits"],
+        "duration": np.array(duration, dtype=np.float64) if compute_rtfx else None,
+        "time": np.array(time, dtype=np.float64) if compute_rtfx else None,
+        "latency": np.array(latencies, dtype=np.float64) if has_latency else None,
+    }
+
+    # Samples whose generation was cut off by the token budget, the WER and RTFx of the other samples show their effect
+    truncated = [datum.get("truncated") for datum in manifest]
+    truncation = None
+    if len(manifest) > 0 and all(flag is not None for flag in truncated):
+        kept = ~np.array(truncated, dtype=bool)
+        kept_words = utterances["words"][kept].sum()
+        truncation = {
+            "num_truncated": int((~kept).sum()),
+            "wer": round(100 * float(utterances["errors"][kept].sum() / kept_words), 2) if kept_words > 0 else None,
+            "audio_length": float(utterances["duration"][kept].sum()) if compute_rtfx else None,
+            "inference_time": float(utterances["time"][kept].sum()) if compute_rtfx else None,
+        }
+
+    return {"wer": wer, "audio_length": audio_length, "inference_time": inference_time, "rtfx": rtfx,
+            "rtfx_median": rtfx_median, "rtfx_p95": rtfx_p95, "trial_time_sums": trial_time_sums,
+            "latency": latency_percentiles(latencies) if has_latency else None, "truncation": truncation,
+            "phase_times": phase_times, **corpus_counts(counts), "utterances": utterances}
+
+
+def latency_percentiles(latencies):
     """
+    Returns the p50, p90 and p99 latency in seconds, keyed by `p<percentile>`.
+    """
+    values = np.percentile(np.asarray(latencies, dtype=np.float64), LATENCY_PERCENTILES)
+    return {f"p{percentile}": round(float(value), 4) for percentile, value in zip(LATENCY_PERCENTILES, values)}
 
-    # DataFrames to save results for UI
-    models = []
-    datasets = []
-    wers = []
-    rtfxs = []
-    composite_wers = []
-    composite_rftxs = []
-    unique_models = []
 
+def format_truncation(truncation: dict):
+    """
+    Table cells of the number of truncated samples and the WER and RTFx without them, empty without a token budget.
+    """
+    if truncation is None:
+        return {"Truncated": "", "WER w/o truncated": "", "RTFX w/o truncated": ""}
+    rtfx = None
+    if truncation["audio_length"] is not None and truncation["inference_time"]:
+        rtfx = truncation["audio_length"] / truncation["inference_time"]
+    return {
+        "Truncated": str(truncation["num_truncated"]),
+        "WER w/o truncated": f"{truncation['wer']:0.2f} %" if truncation["wer"] is not None else "",
+        "RTFX w/o truncated": f"{rtfx:0.2f}" if rtfx is not None else "",
+    }
+
+
+def trial_rtfx_stats(audio_length: float, trial_time_sums: list):
+    """
+    Median and p95 RTFx from the total audio length and the total transcription time of each trial.
+    """
+    trial_rtfx = audio_length / np.asarray(trial_time_sums, dtype=np.float64)
+    return round(float(np.median(trial_rtfx)), 4), round(float(np.percentile(trial_rtfx, 5)), 4)
+
+
+def score_result_files(directory: str, model_id: str = None, num_proc: int = 1, cache_path: str = None,
+                       DEBUG: bool = False):
+    """
+    Scores the result files (jsonl manifests) in a directory, see `score_results`.
+
+    Returns:
+        Dictionary with the scores of each result file, keyed by `<model id> | <dataset id>`.
+    """
     # Strip trailing slash
     if directory.endswith(os.pathsep):
         directory = directory[:-1]
@@ -127,6 +299,8 @@ def score_results(directory: str, model_id: str = None, DEBUG: bool = False):
     # Find all result files in the directory
     result_files = list(glob.glob(f"{directory}/**/*.jsonl", recursive=True))
     result_files = list(sorted(result_files))
+    # Samples dropped by the hallucination filter are written next to the manifests, they are not results
+    result_files = [fp for fp in result_files if not fp.endswith(".dropped.jsonl")]
 
     # Filter files belonging to a specific model id
     if model_id is not None and model_id != "":
@@ -138,49 +312,122 @@ def score_results(directory: str, model_id: str = None, DEBUG: bool = False):
     if len(result_files) == 0:
         raise ValueError(f"No result files found in {directory}")
 
-    # Utility function to parse the file path and extract model id, dataset path, dataset name and split
-    def parse_filepath(fp: str):
-        model_index = fp.find("MODEL_")
-        fp = fp[model_index:]
-        ds_index = fp.find("DATASET_")
-        model_id = fp[:ds_index].replace("MODEL_", "").rstrip("_")
-        author_index = model_id.find("-")
-        model_id = model_id[:author_index] + "/" + model_id[author_index + 1:]
-
-        ds_fp = fp[ds_index:]
-        dataset_id = ds_fp.replace("DATASET_", "").rstrip(".jsonl")
-        return model_id, dataset_id
-
-    # Compute WER results per dataset, and RTFx over all datasets
     results = {}
-    wer_metric = evaluate.load("wer")
+    score_cache = ScoreCache(cache_path) if cache_path is not None else None
 
     for result_file in result_files:
-        manifest = read_manifest(result_file)
         model_id_of_file, dataset_id = parse_filepath(result_file)
 
-        models.append(model_id_of_file)
-        datasets.append(dataset_id)
+        scores = score_cache.get(result_file) if score_cache is not None else None
+        if scores is None:
+            scores = score_manifest(read_manifest(result_file), num_proc=num_proc)
+            if score_cache is not None:
+                score_cache.put(result_file, scores)
 
-        references = [datum["text"] for datum in manifest]
-        predictions = [datum["pred_text"] for datum in manifest]
+        result_key = f"{model_id_of_file} | {dataset_id}"
+        results[result_key] = scores
 
-        time = [datum["time"] for datum in manifest]
-        duration = [datum["duration"] for datum in manifest]
-        compute_rtfx = all(time) and all(duration)
+    if score_cache is not None:
+        score_cache.prune()
+        score_cache.save()
+        if DEBUG: print(f"Score cache: {score_cache.hits} result files cached, {score_cache.misses} rescored")
 
-        wer = wer_metric.compute(references=references, predictions=predictions)
-        wer = round(100 * wer, 2)
+    return results
 
-        if compute_rtfx:
-            audio_length = sum(duration)
-            inference_time = sum(time)
-            rtfx = round(sum(duration) / sum(time), 4)
-        else:
-            audio_length = inference_time = rtfx = None
 
-        result_key = f"{model_id_of_file} | {dataset_id}"
-        results[result_key] = {"wer": wer, "audio_length": audio_length, "inference_time": inference_time, "rtfx": rtfx}
+def score_store(store_dir: str, model_id: str = None, num_proc: int = 1):
+    """
+    Scores the runs in the Parquet results store, reading only the scored columns in one scan.
+
+    Returns:
+        Dictionary with the scores of each run, keyed by `<model id> | <dataset id>`.
+    """
+    names = open_results(store_dir).schema.names
+    columns = ["text", "pred_text", "duration", "time"] + [name for name in names if name.startswith("time_")]
+    columns += [name for name in ["trial_times", "latency", "truncated", "prediction_cached"] if name in names]
+    # Same filter as on the result files: the model id contains `model_id`
+    model_filter = None
+    if model_id is not None and model_id != "":
+        model_filter = pc.match_substring(pc.field("model_id"), model_id)
+    table = read_results(store_dir, columns=columns, filter=model_filter)
+    if table.num_rows == 0:
+        raise ValueError(f"No results found in {store_dir}")
+
+    runs = table.select(["model_id", "dataset_id"]).group_by(["model_id", "dataset_id"]).aggregate([])
+    results = {}
+    for model_id_of_run, dataset_id in sorted(zip(runs["model_id"].to_pylist(), runs["dataset_id"].to_pylist())):
+        mask = pc.and_(pc.equal(table["model_id"], model_id_of_run), pc.equal(table["dataset_id"], dataset_id))
+        manifest = table.filter(mask).drop_columns(["model_id", "dataset_id"]).to_pylist()
+        results[f"{model_id_of_run} | {dataset_id}"] = score_manifest(manifest, num_proc=num_proc)
+    return results
+
+
+def score_results(directory: str, model_id: str = None, DEBUG: bool = False, num_proc: int = 1,
+                  cache_path: str = None, results_store: str = None, num_resamples: int = 1000,
+                  confidence: float = 0.95):
+    """
+    Scores all result files in a directory and returns a composite score over all evaluated datasets.
+
+    Args:
+        directory: Path to the result directory, containing one or more jsonl files.
+        model_id: Optional, model name to filter out result files based on model name.
+        DEBUG: Optional, printing scores
+        num_proc: Optional, number of processes used to align the utterances of a result file.
+        cache_path: Optional, path of a `ScoreCache` file, only result files that are new or modified since the
+            previous call are rescored.
+        results_store: Optional, root directory of a Parquet results store, scored instead of the result files in
+            `directory`.
+        num_resamples: Optional, number of bootstrap resamples of the utterances for the confidence intervals of the
+            WER and RTFx, 0 to leave the intervals out.
+        confidence: Optional, confidence level of the intervals.
+
+    Returns:
+        Composite score over all evaluated datasets and a dictionary of all results.
+
+    """
+
+    # DataFrames to save results for UI
+    models = []
+    datasets = []
+    wers = []
+    rtfxs = []
+    composite_wers = []
+    composite_rftxs = []
+    unique_models = []
+    wer_cis = []
+    rtfx_cis = []
+    composite_wer_cis = []
+    composite_rtfx_cis = []
+    rtfx_medians = []
+    rtfx_p95s = []
+    composite_rtfx_medians = []
+    composite_rtfx_p95s = []
+    latency_columns = {f"Latency p{percentile} (s)": [] for percentile in LATENCY_PERCENTILES}
+    composite_latency_columns = {f"Latency p{percentile} (s)": [] for percentile in LATENCY_PERCENTILES}
+    truncation_columns = {"Truncated": [], "WER w/o truncated": [], "RTFX w/o truncated": []}
+    composite_truncation_columns = {"Truncated": [], "WER w/o truncated": [], "RTFX w/o truncated": []}
+
+    # Compute WER results per dataset, and RTFx over all datasets
+    if results_store is not None:
+        results = score_store(results_store, model_id=model_id, num_proc=num_proc)
+    else:
+        results = score_result_files(directory, model_id=model_id, num_proc=num_proc, cache_path=cache_path,
+                                     DEBUG=DEBUG)
+
+    for result_key in results:
+        model_id_of_file, dataset_id = result_key.split(" | ")
+        models.append(model_id_of_file)
+        datasets.append(dataset_id)
+
+    # Bootstrap resamples of every run, each run gets its own seed so the runs of a model are resampled independently
+    resampled = {}
+    if num_resamples > 0:
+        for k, v in results.items():
+            resampled[k] = bootstrap_run(v["utterances"], num_resamples=num_resamples, seed=zlib.crc32(k.encode()))
+            v["wer_ci"] = percentile_interval(resampled[k]["wer"], confidence)
+            v["rtfx_ci"] = None
+            if resampled[k]["rtfx"] is not None:
+                v["rtfx_ci"] = percentile_interval(resampled[k]["rtfx"], confidence)
 
     if DEBUG:
         print("*" * 80)
@@ -189,17 +436,48 @@ def score_results(directory: str, model_id: str = None, DEBUG: bool = False):
 
     for k, v in results.items():
         metrics = f"{k}: WER = {v['wer']:0.2f} %"
+        metrics += f" (S = {v['substitutions']}, D = {v['deletions']}, I = {v['insertions']})"
+        if "wer_ci" in v:
+            metrics += f", {confidence:.0%} CI = {format_interval(v['wer_ci'])}"
         if v["rtfx"] is not None:
             metrics += f", RTFx = {v['rtfx']:0.2f}"
+        if v.get("rtfx_ci") is not None:
+            metrics += f" {format_interval(v['rtfx_ci'])}"
+        if v.get("rtfx_median") is not None:
+            metrics += f" (median {v['rtfx_median']:0.2f}, p95 {v['rtfx_p95']:0.2f})"
+        if v.get("latency") is not None:
+            metrics += ", latency " + ", ".join(f"{name} = {seconds:0.3f} s" for name, seconds in v["latency"].items())
+        if v.get("truncation") is not None:
+            metrics += f", {v['truncation']['num_truncated']} truncated"
+        if v["phase_times"]:
+            metrics += ", " + ", ".join(f"{phase} = {seconds:0.2f} s" for phase, seconds in v["phase_times"].items())
         if DEBUG: print(metrics)
         wers.append(f"{v['wer']:0.2f} %")
         rtfxs.append(f"{v['rtfx']:0.2f}")
+        wer_cis.append(format_interval(v.get("wer_ci")))
+        rtfx_cis.append(format_interval(v.get("rtfx_ci")))
+        rtfx_medians.append(f"{v['rtfx_median']:0.2f}" if v.get("rtfx_median") is not None else "")
+        rtfx_p95s.append(f"{v['rtfx_p95']:0.2f}" if v.get("rtfx_p95") is not None else "")
+        for percentile in LATENCY_PERCENTILES:
+            latency = v.get("latency")
+            seconds = f"{latency[f'p{percentile}']:0.3f}" if latency is not None else ""
+            latency_columns[f"Latency p{percentile} (s)"].append(seconds)
+        for column, value in format_truncation(v.get("truncation")).items():
+            truncation_columns[column].append(value)
 
     # composite WER should be computed over all datasets and with the same key
     composite_wer = defaultdict(float)
     composite_audio_length = defaultdict(float)
     composite_inference_time = defaultdict(float)
     count_entries = defaultdict(int)
+    # Transcription time of each trial summed over the datasets, None when a dataset has no (or other) trials
+    composite_trial_time_sums = {}
+    # Latencies of the requests of all datasets, None when a dataset was not a latency run
+    composite_latencies = {}
+    # Truncated samples and the sums of the other samples over all datasets, None when a dataset was not limited
+    composite_truncation = {}
+    # Resampled composite scores: the mean of the resampled WERs of the datasets, the resampled durations and times
+    composite_resampled = defaultdict(lambda: {"wer": 0, "duration": 0, "time": 0})
     for k, v in results.items():
         key = k.split("|")[0].strip()
         composite_wer[key] += v["wer"]
@@ -210,6 +488,44 @@ def score_results(directory: str, model_id: str = None, DEBUG: bool = False):
             composite_audio_length[key] = composite_inference_time[key] = None
         count_entries[key] += 1
 
+        trial_time_sums = v.get("trial_time_sums")
+        if key not in composite_trial_time_sums:
+            composite_trial_time_sums[key] = trial_time_sums
+        elif trial_time_sums is None or composite_trial_time_sums[key] is None \
+                or len(trial_time_sums) != len(composite_trial_time_sums[key]):
+            composite_trial_time_sums[key] = None
+        else:
+            composite_trial_time_sums[key] = np.add(composite_trial_time_sums[key], trial_time_sums).tolist()
+
+        latencies = v["utterances"].get("latency")
+        if key not in composite_latencies:
+            composite_latencies[key] = latencies
+        elif latencies is None or composite_latencies[key] is None:
+            composite_latencies[key] = None
+        else:
+            composite_latencies[key] = np.concatenate([composite_latencies[key], latencies])
+
+        truncation = v.get("truncation")
+        if key not in composite_truncation:
+            composite_truncation[key] = dict(truncation, wer=[truncation["wer"]]) if truncation is not None else None
+        elif truncation is None or composite_truncation[key] is None:
+            composite_truncation[key] = None
+        else:
+            sums = composite_truncation[key]
+            sums["num_truncated"] += truncation["num_truncated"]
+            sums["wer"].append(truncation["wer"])
+            for name in ["audio_length", "inference_time"]:
+                sums[name] = sums[name] + truncation[name] if None not in (sums[name], truncation[name]) else None
+
+        if k in resampled:
+            sums, run = composite_resampled[key], resampled[k]
+            sums["wer"] += run["wer"]
+            if run["rtfx"] is not None and sums["duration"] is not None:
+                sums["duration"] += run["duration"]
+                sums["time"] += run["time"]
+            else:
+                sums["duration"] = sums["time"] = None
+
     # normalize scores & print
     if DEBUG:
         print()
@@ -219,19 +535,75 @@ def score_results(directory: str, model_id: str = None, DEBUG: bool = False):
     #unique_models = list(set(models))
     for k, v in composite_wer.items():
         wer = v / count_entries[k]
-        if DEBUG: print(f"{k}: WER = {wer:0.2f} %")
+        wer_ci = None
+        if k in composite_resampled:
+            wer_ci = percentile_interval(composite_resampled[k]["wer"] / count_entries[k], confidence)
+        if DEBUG: print(f"{k}: WER = {wer:0.2f} % {format_interval(wer_ci)}")
         composite_wers.append(f"{wer:0.2f} %")
+        composite_wer_cis.append(format_interval(wer_ci))
         unique_models.append(k)
 
+        latency = None
+        if composite_latencies.get(k) is not None and len(composite_latencies[k]) > 0:
+            latency = latency_percentiles(composite_latencies[k])
+            if DEBUG: print(f"{k}: latency " + ", ".join(f"{name} = {s:0.3f} s" for name, s in latency.items()))
+        for percentile in LATENCY_PERCENTILES:
+            seconds = f"{latency[f'p{percentile}']:0.3f}" if latency is not None else ""
+            composite_latency_columns[f"Latency p{percentile} (s)"].append(seconds)
+
+        # Same composite as the WER: the mean over the datasets
+        truncation = composite_truncation.get(k)
+        if truncation is not None:
+            wers_kept = truncation["wer"]
+            truncation = dict(truncation, wer=sum(wers_kept) / len(wers_kept) if None not in wers_kept else None)
+        for column, value in format_truncation(truncation).items():
+            composite_truncation_columns[column].append(value)
+
     for k in composite_audio_length:
         if composite_audio_length[k] is not None:
             rtfx = composite_audio_length[k] / composite_inference_time[k]
-            if DEBUG: print(f"{k}: RTFx = {rtfx:0.2f}")
+            rtfx_ci = None
+            if k in composite_resampled and composite_resampled[k]["duration"] is not None:
+                rtfx_ci = percentile_interval(composite_resampled[k]["duration"] / composite_resampled[k]["time"],
+                                              confidence)
+            if DEBUG: print(f"{k}: RTFx = {rtfx:0.2f} {format_interval(rtfx_ci)}")
             composite_rftxs.append(f"{rtfx:0.2f}")
+            composite_rtfx_cis.append(format_interval(rtfx_ci))
+
+            rtfx_median = rtfx_p95 = ""
+            if composite_trial_time_sums.get(k) is not None:
+                rtfx_median, rtfx_p95 = trial_rtfx_stats(composite_audio_length[k], composite_trial_time_sums[k])
+                if DEBUG: print(f"{k}: RTFx over trials: median {rtfx_median:0.2f}, p95 {rtfx_p95:0.2f}")
+                rtfx_median, rtfx_p95 = f"{rtfx_median:0.2f}", f"{rtfx_p95:0.2f}"
+            composite_rtfx_medians.append(rtfx_median)
+            composite_rtfx_p95s.append(rtfx_p95)
     # print("*" * 80)
 
     all_df = pd.DataFrame({"model": models, "dataset": datasets, "WER": wers, "RTFX": rtfxs})
     composite_df = pd.DataFrame({"model": unique_models, "WER": composite_wers, "RTFX": composite_rftxs})
+    if num_resamples > 0:
+        all_df.insert(3, f"WER {confidence:.0%} CI", wer_cis)
+        all_df[f"RTFX {confidence:.0%} CI"] = rtfx_cis
+        composite_df.insert(2, f"WER {confidence:.0%} CI", composite_wer_cis)
+        composite_df[f"RTFX {confidence:.0%} CI"] = composite_rtfx_cis
+    # Only runs timed over several trials have a median and p95 RTFx
+    if any(rtfx_medians):
+        all_df["RTFX median"] = rtfx_medians
+        all_df["RTFX p95"] = rtfx_p95s
+        composite_df["RTFX median"] = composite_rtfx_medians
+        composite_df["RTFX p95"] = composite_rtfx_p95s
+    # Only latency runs have latency percentiles
+    if any(any(values) for values in latency_columns.values()):
+        for column, values in latency_columns.items():
+            all_df[column] = values
+        for column, values in composite_latency_columns.items():
+            composite_df[column] = values
+    # Only runs with a token budget have truncated samples
+    if any(truncation_columns["Truncated"]):
+        for column, values in truncation_columns.items():
+            all_df[column] = values
+        for column, values in composite_truncation_columns.items():
+            composite_df[column] = values
 
     return composite_wer, results, all_df, composite_df
 
@@ -18,6 +18,8 @@ import unicodedata
 
 import regex
 
+from .variants import VariantLexicon
+
 
 # non-ASCII letters that are not separated by "NFKD" normalization
 ADDITIONAL_DIACRITICS = {
@@ -40,50 +42,137 @@ ADDITIONAL_DIACRITICS = {
 }
 
 
+def replace_symbol_or_diacritic(char: str, keep=""):
+    """
+    Replacement of one character by `remove_symbols_and_diacritics`.
+    """
+    if char in keep:
+        return char
+    elif char in ADDITIONAL_DIACRITICS:
+        return ADDITIONAL_DIACRITICS[char]
+
+    elif unicodedata.category(char) == "Mn":
+        return ""
+
+    elif unicodedata.category(char)[0] in "MSP":
+        return " "
+
+    return char
+
+
+def replace_symbol(char: str):
+    """
+    Replacement of one character by `remove_symbols`.
+    """
+    return " " if unicodedata.category(char)[0] in "MSP" else char
+
+
 def remove_symbols_and_diacritics(s: str, keep=""):
     """
     Replace any other markers, symbols, and punctuations with a space, and drop any diacritics (category 'Mn' and some
     manual mappings)
     """
+    return "".join(replace_symbol_or_diacritic(c, keep) for c in unicodedata.normalize("NFKD", s))
 
-    def replace_character(char):
-        if char in keep:
-            return char
-        elif char in ADDITIONAL_DIACRITICS:
-            return ADDITIONAL_DIACRITICS[char]
 
-        elif unicodedata.category(char) == "Mn":
-            return ""
+def remove_symbols(s: str):
+    """
+    Replace any other markers, symbols, punctuations with a space, keeping diacritics
+    """
+    return "".join(replace_symbol(c) for c in unicodedata.normalize("NFKC", s))
 
-        elif unicodedata.category(char)[0] in "MSP":
-            return " "
 
-        return char
+class TranslationTable(dict):
+    """
+    `str.translate` table replacing every character by `replace(character)`.
 
-    return "".join(replace_character(c) for c in unicodedata.normalize("NFKD", s))
+    The Latin-1 range and `precompute` are filled when the table is created, other code points are added the first
+    time they occur (`__missing__`), so a character is only looked up in the Unicode database once.
+    """
 
+    def __init__(self, replace, precompute: str = ""):
+        super().__init__()
+        self.replace = replace
+        for code_point in list(range(256)) + [ord(char) for char in precompute]:
+            self[code_point] = replace(chr(code_point))
 
-def remove_symbols(s: str):
+    def __missing__(self, code_point: int):
+        replacement = self.replace(chr(code_point))
+        self[code_point] = replacement
+        return replacement
+
+
+BRACKETS = re.compile(r"[<\[][^>\]]*[>\]]")
+PARENTHESES = re.compile(r"\(([^)]+?)\)")
+
+
+def collapse_whitespace(s: str):
     """
-    Replace any other markers, symbols, punctuations with a space, keeping diacritics
+    Same as `re.sub(r"\s+", " ", s)`: `str.split` splits on the characters `\s` matches, leading and trailing
+    whitespace is kept as one space.
     """
-    return "".join(" " if unicodedata.category(c)[0] in "MSP" else c for c in unicodedata.normalize("NFKC", s))
+    words = s.split()
+    collapsed = " ".join(words)
+    if s[:1].isspace():
+        collapsed = " " + collapsed if words else " "
+    if words and s[-1:].isspace():
+        collapsed += " "
+    return collapsed
 
 
 class BasicTextNormalizer:
-    def __init__(self, remove_diacritics: bool = False, split_letters: bool = False):
+    def __init__(self, remove_diacritics: bool = False, split_letters: bool = False, variants: dict = None):
         self.clean = remove_symbols_and_diacritics if remove_diacritics else remove_symbols
+        self.remove_diacritics = remove_diacritics
         self.split_letters = split_letters
+        self.variants = None
+
+        # `self.clean` compiled to a Unicode normalization and a single `str.translate` pass
+        if remove_diacritics:
+            self.unicode_form = "NFKD"
+            self.table = TranslationTable(replace_symbol_or_diacritic, precompute="".join(ADDITIONAL_DIACRITICS))
+        else:
+            self.unicode_form = "NFKC"
+            self.table = TranslationTable(replace_symbol)
+
+        # Optional spelling variant lexicon (variant -> canonical form), normalized like the texts it is applied to
+        if variants is not None:
+            self.variants = VariantLexicon(
+                {self(variant): self(canonical).strip() for variant, canonical in variants.items()}
+            )
 
     def __call__(self, s: str):
         s = s.lower()
-        s = re.sub(r"[<\[][^>\]]*[>\]]", "", s)  # remove words between brackets
-        s = re.sub(r"\(([^)]+?)\)", "", s)  # remove words between parenthesis
-        s = self.clean(s).lower()
+        if "<" in s or "[" in s:
+            s = BRACKETS.sub("", s)  # remove words between brackets
+        if "(" in s:
+            s = PARENTHESES.sub("", s)  # remove words between parenthesis
+        s = unicodedata.normalize(self.unicode_form, s).translate(self.table).lower()
 
         if self.split_letters:
             s = " ".join(regex.findall(r"\X", s, regex.U))
 
-        s = re.sub(r"\s+", " ", s)  # replace any successive whitespace characters with a space
-
-        return s
\ No newline at end of file
+        s = collapse_whitespace(s)  # replace any successive whitespace characters with a space
+
+        if self.variants is not None:
+            s = self.variants(s)  # replace spelling variants by their canonical form
+
+        return s
+
+    def config(self):
+        """
+        Settings that change the normalized text, part of the fingerprint of the normalized dataset column.
+        """
+        return {
+            "remove_diacritics": self.remove_diacritics,
+            "split_letters": self.split_letters,
+            "variants": self.variants.fingerprint if self.variants is not None else None,
+        }
+
+    def normalize_batch(self, texts: list):
+        """
+        Normalizes a list of texts, repeated texts (e.g. the references of a dataset scored for every model) are
+        normalized once.
+        """
+        normalized = {s: self(s) for s in dict.fromkeys(texts)}
+        return [normalized[s] for s in texts]
\ No newline at end of file
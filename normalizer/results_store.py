@@ -0,0 +1,96 @@
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Results are partitioned by model and dataset, e.g. `model_id=openai%2Fwhisper-small/dataset_id=.../part-0-0.parquet`
+PARTITIONING = ds.partitioning(
+    pa.schema([("model_id", pa.string()), ("dataset_id", pa.string())]), flavor="hive"
+)
+
+# Typed columns of every sample, extra fields (e.g. the phase timings) are added with their inferred type
+SCHEMA = pa.schema([
+    ("sample_index", pa.int64()),
+    ("duration", pa.float64()),
+    ("time", pa.float64()),
+    ("text", pa.string()),
+    ("pred_text", pa.string()),
+])
+
+
+def write_results(
+        store_dir: str,
+        model_id: str,
+        dataset_id: str,
+        columns: dict,
+        metadata: dict = None,
+        append: bool = False,
+        start_index: int = 0,
+):
+    """
+    Writes the samples of a run to the partition of its model and dataset in the results store.
+
+    Args:
+        store_dir: Root directory of the results store.
+        model_id: Model id of the run.
+        dataset_id: Dataset id of the run, as in the manifest file name.
+        columns: Columns of `SCHEMA` and extra fields, mapping the column name to one value per sample.
+        metadata: Optional, run metadata stored as constant columns, e.g. the dataset path and name.
+        append: Optional, add the samples to the partition instead of replacing it.
+        start_index: Optional, index of the first sample, used to number appended samples.
+    """
+    num_samples = len(columns["text"])
+    columns = {"sample_index": list(range(start_index, start_index + num_samples)), **columns}
+    metadata = metadata if metadata is not None else {}
+
+    arrays = [pa.array(columns[field.name], type=field.type) for field in SCHEMA]
+    fields = list(SCHEMA)
+    for name, values in columns.items():
+        if name not in SCHEMA.names:
+            # Phase timings are None for the samples served by the prediction cache, a window of only cached samples
+            # still writes them as floats
+            arrays.append(pa.array(values, type=pa.float64() if name.startswith("time_") else None))
+            fields.append(pa.field(name, arrays[-1].type))
+    for name, value in metadata.items():
+        arrays.append(pa.array(num_samples * [value], type=pa.string()))
+        fields.append(pa.field(name, pa.string()))
+    arrays += [pa.array(num_samples * [model_id]), pa.array(num_samples * [dataset_id])]
+    fields += list(PARTITIONING.schema)
+
+    ds.write_dataset(
+        pa.Table.from_arrays(arrays, schema=pa.schema(fields)),
+        store_dir,
+        format="parquet",
+        partitioning=PARTITIONING,
+        # appended windows get their own file, a new run replaces the files of its partition
+        basename_template=f"part-{start_index}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore" if append else "delete_matching",
+    )
+
+
+def open_results(store_dir: str):
+    """
+    Opens the results store as a `pyarrow.dataset.Dataset`, with the columns of every run in its schema.
+    """
+    dataset = ds.dataset(store_dir, format="parquet", partitioning=PARTITIONING)
+    # Runs can have different extra fields, only the file footers are read to unify their schemas
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()] + [dataset.schema])
+    return ds.dataset(store_dir, schema=schema, format="parquet", partitioning=PARTITIONING)
+
+
+def read_results(store_dir: str, columns: list = None, filter=None):
+    """
+    Reads samples from the results store in one scan.
+
+    Args:
+        store_dir: Root directory of the results store.
+        columns: Optional, columns to read, only these are read from the files. Reads every column by default.
+        filter: Optional, `pyarrow.dataset` expression selecting the samples, e.g.
+            `ds.field("model_id") == "openai/whisper-small"`. Expressions on `model_id` and `dataset_id` skip the
+            files of other runs without opening them.
+
+    Returns:
+        `pyarrow.Table` with the requested columns, and the `model_id` and `dataset_id` of each sample.
+    """
+    dataset = open_results(store_dir)
+    if columns is not None:
+        columns = ["model_id", "dataset_id"] + [column for column in columns if column not in PARTITIONING.schema.names]
+    return dataset.to_table(columns=columns, filter=filter)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Bumped whenever the stored scores change, so an old cache file is rebuilt instead of misread
+CACHE_VERSION = 3
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ScoreCache:
+    """
+    Persistent cache of the scores of result files, so only new or modified manifests are rescored.
+
+    Entries are keyed by the absolute path of the manifest and validated against its size and modification time. A
+    manifest that was touched without being changed (same size, same content hash) keeps its scores.
+
+    The JSON file only indexes the scalar scores. The per-utterance arrays of each manifest are stored in an `.npz`
+    file of their own in the `<path>.arrays` directory, written once when the manifest is scored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.arrays_dir = f"{path}.arrays"
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        # Whether the entries changed since they were read, only then `save` writes the cache file
+        self.dirty = False
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("version") == CACHE_VERSION:
+                self.entries = cache["entries"]
+
+    def get(self, manifest_path: str):
+        """
+        Returns the cached scores of a manifest, or None if the manifest is new or was modified.
+        """
+        key = os.path.abspath(manifest_path)
+        entry = self.entries.get(key)
+        stat = os.stat(manifest_path)
+        if entry is not None and not os.path.exists(entry["arrays"]):
+            # The arrays were deleted, the manifest is rescored
+            entry = None
+
+        if entry is not None and entry["size"] == stat.st_size:
+            if entry["mtime_ns"] == stat.st_mtime_ns:
+                self.hits += 1
+                return self.scores(entry)
+            if entry["hash"] == file_hash(manifest_path):
+                entry["mtime_ns"] = stat.st_mtime_ns
+                self.dirty = True
+                self.hits += 1
+                return self.scores(entry)
+
+        self.misses += 1
+        return None
+
+    def arrays_path(self, key: str):
+        return os.path.join(self.arrays_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".npz")
+
+    def scores(self, entry: dict):
+        # Utterance arrays that are None (e.g. timings of runs without RTFx) are not in the `.npz` file
+        with np.load(entry["arrays"]) as arrays:
+            utterances = {key: arrays[key] if key in arrays.files else None for key in entry["utterance_keys"]}
+        return {**entry["scores"], "utterances": utterances}
+
+    def put(self, manifest_path: str, scores: dict):
+        key = os.path.abspath(manifest_path)
+        arrays_path = self.arrays_path(key)
+        os.makedirs(self.arrays_dir, exist_ok=True)
+        # Written to a temporary file first, so a reader never sees partially written arrays
+        tmp_path = f"{arrays_path}.tmp.npz"
+        np.savez(tmp_path, **{name: values for name, values in scores["utterances"].items() if values is not None})
+        os.replace(tmp_path, arrays_path)
+
+        stat = os.stat(manifest_path)
+        self.entries[key] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": file_hash(manifest_path),
+            "scores": {name: value for name, value in scores.items() if name != "utterances"},
+            "utterance_keys": list(scores["utterances"]),
+            "arrays": arrays_path,
+        }
+        self.dirty = True
+
+    def prune(self):
+        """
+        Drops the entries of deleted result files.
+        """
+        entries = {key: entry for key, entry in self.entries.items() if os.path.exists(key)}
+        for key in self.entries.keys() - entries.keys():
+            if os.path.exists(self.entries[key]["arrays"]):
+                os.remove(self.entries[key]["arrays"])
+        if len(entries) < len(self.entries):
+            self.entries = entries
+            self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache file, if any entry changed since it was read.
+        """
+        if not self.dirty:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Written to a temporary file first, so a reader never sees a partially written cache
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, f, default=lambda value: value.tolist())
+        os.replace(tmp_path, self.path)
+        self.dirty = False
@@ -0,0 +1,65 @@
+import hashlib
+import json
+
+
+def load_variant_lexicon(path: str):
+    """
+    Reads a spelling variant lexicon: one `<variant>\t<canonical>` pair per line, lines starting with `#` are comments.
+
+    Returns:
+        Dictionary mapping every variant to its canonical form.
+    """
+    variants = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.rstrip("\n")
+            if len(line.strip()) == 0 or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) != 2:
+                raise ValueError(f"{path}:{line_number}: expected `<variant>\\t<canonical>`, got `{line}`.")
+            variants[fields[0].strip()] = fields[1].strip()
+    return variants
+
+
+class VariantLexicon:
+    """
+    Many-to-one spelling variant lexicon, replacing every variant (one or more words) by its canonical form.
+
+    Variants are compiled into a hash map from word tuples to canonical forms, so a text is rewritten in one pass over
+    its words whatever the size of the lexicon. Where variants overlap, the longest variant starting at a word wins.
+    """
+
+    def __init__(self, variants: dict):
+        self.phrases = {}
+        for variant, canonical in variants.items():
+            words = tuple(variant.split())
+            if len(words) > 0 and variant != canonical:
+                self.phrases[words] = canonical
+        self.words = {words[0]: canonical for words, canonical in self.phrases.items() if len(words) == 1}
+        self.max_words = max((len(words) for words in self.phrases), default=0)
+
+        items = sorted((" ".join(words), canonical) for words, canonical in self.phrases.items())
+        self.fingerprint = hashlib.sha256(json.dumps(items, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def __call__(self, s: str):
+        words = s.split(" ")
+        if self.max_words <= 1:
+            return " ".join([self.words.get(word, word) for word in words])
+
+        rewritten = []
+        idx = 0
+        while idx < len(words):
+            for num_words in range(min(self.max_words, len(words) - idx), 1, -1):
+                canonical = self.phrases.get(tuple(words[idx:idx + num_words]))
+                if canonical is not None:
+                    rewritten.append(canonical)
+                    idx += num_words
+                    break
+            else:
+                rewritten.append(self.words.get(words[idx], words[idx]))
+                idx += 1
+        return " ".join(rewritten)
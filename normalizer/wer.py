@@ -0,0 +1,144 @@
+import re
+from multiprocessing import Pool
+
+import numpy as np
+
+try:
+    from rapidfuzz.distance import Levenshtein
+except ImportError:
+    Levenshtein = None
+
+# Edit operations are packed into one integer per alignment: the edit distance in the highest digits, then the
+# substitutions, deletions and insertions. The smallest packed value belongs to an optimal alignment, so the edit
+# distance (and therefore the WER) is exact; ties between optimal alignments go to the fewest substitutions.
+_BASE = 1 << 20
+_INSERTION = 1
+_DELETION = _BASE
+_SUBSTITUTION = _BASE ** 2
+_EDIT = _BASE ** 3
+
+COUNT_KEYS = ["hits", "substitutions", "deletions", "insertions"]
+
+_MULTIPLE_SPACES = re.compile(r"\s\s+")
+
+
+def tokenize(s: str):
+    """
+    Splits a transcript into words the way the `wer` metric of `evaluate` (`jiwer`) does.
+    """
+    return [word for word in _MULTIPLE_SPACES.sub(" ", s).strip().split(" ") if len(word) >= 1]
+
+
+def align(reference: list, prediction: list):
+    """
+    Counts the hits, substitutions, deletions and insertions of an optimal alignment of two token id sequences.
+
+    Returns:
+        Tuple of hits, substitutions, deletions and insertions.
+    """
+    num_reference = len(reference)
+
+    # The common prefix and suffix are hits and don't take part in the alignment
+    start = 0
+    end_ref, end_pred = len(reference), len(prediction)
+    while start < end_ref and start < end_pred and reference[start] == prediction[start]:
+        start += 1
+    while end_ref > start and end_pred > start and reference[end_ref - 1] == prediction[end_pred - 1]:
+        end_ref -= 1
+        end_pred -= 1
+    reference = reference[start:end_ref]
+    prediction = prediction[start:end_pred]
+
+    previous = [j * (_EDIT + _INSERTION) for j in range(len(prediction) + 1)]
+    for i, ref_token in enumerate(reference, start=1):
+        current = [i * (_EDIT + _DELETION)]
+        for j, pred_token in enumerate(prediction, start=1):
+            diagonal = previous[j - 1] if ref_token == pred_token else previous[j - 1] + _EDIT + _SUBSTITUTION
+            current.append(min(diagonal, previous[j] + _EDIT + _DELETION, current[j - 1] + _EDIT + _INSERTION))
+        previous = current
+
+    packed = previous[-1]
+    substitutions = (packed // _SUBSTITUTION) % _BASE
+    deletions = (packed // _DELETION) % _BASE
+    insertions = packed % _BASE
+    return num_reference - substitutions - deletions, substitutions, deletions, insertions
+
+
+def align_native(reference: list, prediction: list):
+    """
+    Same as `align`, using the compiled Levenshtein kernel of `rapidfuzz` (the kernel `jiwer` uses).
+    """
+    if reference == prediction:
+        return len(reference), 0, 0, 0
+
+    substitutions = deletions = insertions = 0
+    for tag, _, _ in Levenshtein.editops(reference, prediction):
+        if tag == "replace":
+            substitutions += 1
+        elif tag == "delete":
+            deletions += 1
+        else:
+            insertions += 1
+    return len(reference) - substitutions - deletions, substitutions, deletions, insertions
+
+
+# The compiled kernel when `rapidfuzz` is installed, the pure Python alignment otherwise
+_align = align if Levenshtein is None else align_native
+
+
+def _count_chunk(pairs: list):
+    # Words are interned to integer ids, so the alignment only compares small integers
+    vocabulary = {}
+    counts = []
+    for reference, prediction in pairs:
+        reference_ids = [vocabulary.setdefault(word, len(vocabulary)) for word in tokenize(reference)]
+        prediction_ids = [vocabulary.setdefault(word, len(vocabulary)) for word in tokenize(prediction)]
+        counts.append(_align(reference_ids, prediction_ids))
+    return counts
+
+
+def utterance_counts(references: list, predictions: list, num_proc: int = 1, chunk_size: int = 2048):
+    """
+    Computes the hits, substitutions, deletions and insertions of every utterance.
+
+    Args:
+        references: Ground truth reference texts.
+        predictions: Model predicted transcriptions.
+        num_proc: Optional, number of processes the utterances are spread over.
+        chunk_size: Optional, number of utterances per process task.
+
+    Returns:
+        Dictionary with one integer array per count (see `COUNT_KEYS`), with one value per utterance.
+    """
+    if len(references) != len(predictions):
+        raise ValueError(
+            f"The number of samples in `references` ({len(references)}) "
+            f"must match `predictions` ({len(predictions)})."
+        )
+
+    pairs = list(zip(references, predictions))
+    chunks = [pairs[start:start + chunk_size] for start in range(0, len(pairs), chunk_size)]
+    if num_proc > 1 and len(chunks) > 1:
+        with Pool(min(num_proc, len(chunks))) as pool:
+            chunk_counts = pool.map(_count_chunk, chunks)
+    else:
+        chunk_counts = [_count_chunk(chunk) for chunk in chunks]
+
+    counts = np.array([count for chunk in chunk_counts for count in chunk], dtype=np.int64).reshape(-1, 4)
+    return {key: counts[:, idx] for idx, key in enumerate(COUNT_KEYS)}
+
+
+def corpus_counts(counts: dict):
+    """
+    Sums per-utterance counts into corpus counts.
+    """
+    return {key: int(np.sum(counts[key])) for key in COUNT_KEYS}
+
+
+def word_error_rate(counts: dict):
+    """
+    Word error rate (S + D + I) / (S + D + H) of per-utterance or corpus counts, as computed by `evaluate`.
+    """
+    totals = corpus_counts(counts)
+    errors = totals["substitutions"] + totals["deletions"] + totals["insertions"]
+    return errors / (totals["substitutions"] + totals["deletions"] + totals["hits"])
@@ -1,20 +1,35 @@
 import gradio as gr
 import pandas as pd
 
-from normalizer.eval_utils import score_results
+from example_cache import ExampleCache
+from leaderboard import LeaderboardWatcher
 from constants import TITLE, INTRODUCTION_TEXT, AURIS_ORIGINAL_DESCRIPTION, METRICS_TEXT, WER, RTFX, GITHUB_REPO
 
-_, _, all_df, composite_df = score_results("../results/")
+RESULTS_STORE = "../results_store/"
 
-numeric_wer = []
-numeric_rtfx = []
+# The saved leaderboard snapshot is served at startup, the watcher rebuilds it when result files change
+leaderboard = LeaderboardWatcher("../results/", "../cache/leaderboard.json",
+                                 cache_path="../cache/score_cache.json").start()
+all_df, composite_df, stats = leaderboard.tables()
 
 unique_dataset = list(set(all_df['dataset']))
 
-for wer in all_df['WER']:
-    numeric_wer.append(float(wer.strip().replace('%', '')))
-for rtxf in all_df['RTFX']:
-    numeric_rtfx.append(float(rtxf.strip()))
+# Examples of every run are loaded in the background, so switching between them in the UI is instant
+example_cache = ExampleCache("../results/", results_store=RESULTS_STORE)
+example_cache.prefetch(zip(all_df['model'], all_df['dataset']))
+
+
+def refresh_leaderboard():
+    all_df, composite_df, stats = leaderboard.tables()
+    return (
+        f"{stats['lowest_wer']}%",
+        f"{stats['highest_rtfx']}",
+        all_df,
+        composite_df,
+        gr.Dropdown(choices=composite_df['model'].tolist()),
+        gr.Dropdown(choices=list(set(all_df['dataset']))),
+    )
+
 
 with gr.Blocks() as demo:
     gr.HTML(TITLE)
@@ -24,15 +39,15 @@ with gr.Blocks() as demo:
         with gr.TabItem("All Tests"):
             gr.Markdown("## Stats")
             with gr.Row():
-                gr.Label(f"{min(numeric_wer)}%", label="Lowest WER")
-                gr.Label(f"{max(numeric_rtfx)}", label="Highest RTFX")
+                lowest_wer = gr.Label(f"{stats['lowest_wer']}%", label="Lowest WER")
+                highest_rtfx = gr.Label(f"{stats['highest_rtfx']}", label="Highest RTFX")
 
             gr.Markdown("## Benchmark")
-            gr.DataFrame(all_df)
+            all_table = gr.DataFrame(all_df)
 
         with gr.TabItem("Composite Results"):
             gr.Markdown("## Average per Model")
-            gr.DataFrame(composite_df)
+            composite_table = gr.DataFrame(composite_df)
             # TODO: add a bar chart
             # TODO: make sure that results are being displayed directly with the lowest WER at the top
 
@@ -51,12 +66,13 @@ with gr.Blocks() as demo:
 
             @gr.on(inputs=[models, data], outputs=examples_df)
             def filtered_data(models, data):
-                j_file = f"../results/MODEL_{models.replace('/', '-')}_DATASET_{data}.jsonl"
                 try:
-                    j_df = pd.read_json(j_file, lines=True)
-                    return pd.DataFrame({"Original": j_df['text'], "Predicted": j_df['pred_text']})
-                except:
-                    return pd.DataFrame({"Original": ['work in progress'], "Predicted": ['work in progress']})
+                    return example_cache.get(models, data)
+                except FileNotFoundError as e:
+                    gr.Warning(str(e))
+                    return pd.DataFrame({"Original": [], "Predicted": []})
+                except Exception as e:
+                    raise gr.Error(f"Cannot load the examples of `{models}` on `{data}`: {e}")
 
         with gr.TabItem("About the Project"):
             gr.Markdown(AURIS_ORIGINAL_DESCRIPTION)
@@ -68,4 +84,8 @@ with gr.Blocks() as demo:
 
             gr.Markdown("## Datasets Used")
 
+    # Rebuilt snapshots are swapped into open pages without a restart
+    gr.Timer(30).tick(refresh_leaderboard,
+                      outputs=[lowest_wer, highest_rtfx, all_table, composite_table, models, data])
+
 demo.launch()
@@ -0,0 +1,137 @@
+import glob
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from normalizer.eval_utils import parse_filepath
+from normalizer.results_store import read_results
+
+
+class ExampleCache:
+    """
+    In-process LRU cache of the example frames (original and predicted transcriptions) of each model and dataset.
+
+    Frames are loaded in background threads, from the results store when it holds the run and from the result file
+    otherwise. A cached frame is reloaded when the files of its run are modified, and the least recently used frames
+    are evicted once the cached frames take more than `max_bytes` of memory.
+    """
+
+    def __init__(self, results_dir: str, results_store: str = None, max_bytes: int = 256 * 1024 ** 2,
+                 num_workers: int = 2):
+        self.results_dir = results_dir
+        self.results_store = results_store
+        self.max_bytes = max_bytes
+
+        self.frames = OrderedDict()  # (model, dataset) -> (signature, frame, size in bytes)
+        self.num_bytes = 0
+        self.pending = {}  # (model, dataset) -> future of a running load
+        self.result_files = {}
+        # Reentrant, the done callback of a load that already finished runs while `submit` holds the lock
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="example-cache")
+
+    def index_result_files(self):
+        result_files = sorted(glob.glob(f"{self.results_dir}/**/*.jsonl", recursive=True))
+        result_files = [fp for fp in result_files if not fp.endswith(".dropped.jsonl")]
+        self.result_files = {parse_filepath(fp): fp for fp in result_files}
+
+    def source(self, model: str, dataset: str):
+        """
+        Returns the files holding the examples of a run, and whether they belong to the results store.
+        """
+        if self.results_store is not None:
+            # Same directory names as the hive partitioning of the results store
+            partition = os.path.join(self.results_store, f"model_id={quote(model, safe='')}",
+                                     f"dataset_id={quote(dataset, safe='')}")
+            files = sorted(glob.glob(os.path.join(partition, "*.parquet")))
+            if len(files) > 0:
+                return files, True
+
+        if (model, dataset) not in self.result_files:
+            # New result files are picked up the first time they are asked for
+            self.index_result_files()
+        if (model, dataset) not in self.result_files:
+            raise FileNotFoundError(f"No results of `{model}` on `{dataset}` in {self.results_dir}.")
+        return [self.result_files[(model, dataset)]], False
+
+    @staticmethod
+    def signature(files: list):
+        return tuple((fp, os.stat(fp).st_mtime_ns) for fp in files)
+
+    def load(self, model: str, dataset: str):
+        files, in_store = self.source(model, dataset)
+        signature = self.signature(files)
+
+        if in_store:
+            table = read_results(
+                self.results_store,
+                columns=["sample_index", "text", "pred_text"],
+                filter=(ds.field("model_id") == model) & (ds.field("dataset_id") == dataset),
+            )
+            examples = table.to_pandas().sort_values("sample_index")
+        else:
+            examples = pd.read_json(files[0], lines=True)
+        frame = pd.DataFrame({"Original": examples["text"].values, "Predicted": examples["pred_text"].values})
+
+        with self.lock:
+            if (model, dataset) in self.frames:
+                self.num_bytes -= self.frames.pop((model, dataset))[2]
+            size = int(frame.memory_usage(deep=True).sum())
+            self.frames[(model, dataset)] = (signature, frame, size)
+            self.num_bytes += size
+
+            # Least recently used frames go first, the frame just loaded is always kept
+            while self.num_bytes > self.max_bytes and len(self.frames) > 1:
+                _, (_, _, evicted_size) = self.frames.popitem(last=False)
+                self.num_bytes -= evicted_size
+        return frame
+
+    def submit(self, model: str, dataset: str):
+        # Concurrent requests for the same run share one load
+        with self.lock:
+            future = self.pending.get((model, dataset))
+            if future is None:
+                future = self.executor.submit(self.load, model, dataset)
+                self.pending[(model, dataset)] = future
+                future.add_done_callback(lambda _: self.discard_pending(model, dataset, future))
+        return future
+
+    def discard_pending(self, model: str, dataset: str, future):
+        with self.lock:
+            if self.pending.get((model, dataset)) is future:
+                del self.pending[(model, dataset)]
+
+    def prefetch(self, runs: list):
+        """
+        Loads the examples of each (model, dataset) run in the background, e.g. when the app starts.
+        """
+        for model, dataset in runs:
+            self.submit(model, dataset)
+
+    def get(self, model: str, dataset: str):
+        """
+        Returns the example frame of a run, loading it unless an up to date frame is cached.
+
+        Raises:
+            FileNotFoundError: if there are no results of the model on the dataset.
+        """
+        with self.lock:
+            cached = self.frames.get((model, dataset))
+            if cached is not None:
+                self.frames.move_to_end((model, dataset))
+
+        if cached is not None:
+            signature, frame, _ = cached
+            try:
+                files, _ = self.source(model, dataset)
+                if self.signature(files) == signature:
+                    return frame
+            except FileNotFoundError:
+                pass
+
+        return self.submit(model, dataset).result()
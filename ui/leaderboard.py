@@ -0,0 +1,124 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from normalizer.eval_utils import score_results
+
+# Bumped whenever the snapshot layout changes, so an old snapshot is rebuilt instead of misread
+SNAPSHOT_VERSION = 2
+
+
+def results_signature(results_dir: str):
+    """
+    Path, size and modification time of every result file, a snapshot is outdated when these change.
+    """
+    result_files = sorted(glob.glob(f"{results_dir}/**/*.jsonl", recursive=True))
+    result_files = [fp for fp in result_files if not fp.endswith(".dropped.jsonl")]
+    signature = []
+    for fp in result_files:
+        stat = os.stat(fp)
+        signature.append([fp, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def build_snapshot(results_dir: str, cache_path: str = None):
+    """
+    Scores the result files and returns the leaderboard snapshot: the per-dataset and composite tables and the stats.
+    """
+    # Taken before scoring, so result files written while scoring trigger the next rebuild
+    signature = results_signature(results_dir)
+    _, _, all_df, composite_df = score_results(results_dir, cache_path=cache_path)
+
+    numeric_wer = [float(wer.strip().replace('%', '')) for wer in all_df['WER']]
+    numeric_rtfx = [float(rtfx.strip()) for rtfx in all_df['RTFX']]
+    return {
+        "version": SNAPSHOT_VERSION,
+        "built_at": time.time(),
+        "signature": signature,
+        "all": all_df.to_dict(orient="list"),
+        "composite": composite_df.to_dict(orient="list"),
+        "stats": {"lowest_wer": min(numeric_wer), "highest_rtfx": max(numeric_rtfx)},
+    }
+
+
+def save_snapshot(snapshot: dict, snapshot_path: str):
+    directory = os.path.dirname(snapshot_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # Written to a temporary file first, so a starting app never reads a partially written snapshot
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, snapshot_path)
+
+
+def load_snapshot(snapshot_path: str):
+    """
+    Returns the saved snapshot, or None if there is none or it was written by another snapshot version.
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, "r", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    return snapshot if snapshot.get("version") == SNAPSHOT_VERSION else None
+
+
+class LeaderboardWatcher:
+    """
+    Serves the leaderboard snapshot and rebuilds it in a background thread when the result files change.
+
+    The saved snapshot is served right away, even if it is outdated, and swapped for the rebuilt snapshot once the
+    watcher has rescored the new or modified result files (through the score cache at `cache_path`).
+    """
+
+    def __init__(self, results_dir: str, snapshot_path: str, cache_path: str = None, interval: float = 30.0):
+        self.results_dir = results_dir
+        self.snapshot_path = snapshot_path
+        self.cache_path = cache_path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.snapshot = load_snapshot(snapshot_path)
+        if self.snapshot is None:
+            # First start, there is nothing to serve before the results are scored
+            self.rebuild()
+
+    def rebuild(self):
+        snapshot = build_snapshot(self.results_dir, cache_path=self.cache_path)
+        save_snapshot(snapshot, self.snapshot_path)
+        # A single reference assignment, readers get either the old or the new snapshot
+        self.snapshot = snapshot
+
+    def poll(self):
+        if results_signature(self.results_dir) != self.snapshot["signature"]:
+            self.rebuild()
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Leaderboard rebuild failed, serving the previous snapshot: {e}")
+            if self.stop_event.wait(self.interval):
+                break
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="leaderboard-watcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def tables(self):
+        """
+        Returns the per-dataset table, the composite table and the stats of the current snapshot.
+        """
+        snapshot = self.snapshot
+        return pd.DataFrame(snapshot["all"]), pd.DataFrame(snapshot["composite"]), snapshot["stats"]